@@ -0,0 +1,280 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+from ChessEngine import ChessBoard
+from ChessPerft import perft
+from ChessPgn import toSan
+from ChessSearch import Searcher, MAX_PLY
+
+"""
+Batch analysis of EPD or FEN files. Positions are read one line at a time, analysed on a process pool with a bounded
+number of batches in flight, and written out as JSON lines as they finish, either in input order or in the order
+they complete. The output file doubles as the checkpoint: every result carries the index of its position, so a run
+that is stopped, or dies, is resumed with --resume and only the positions missing from the output are analysed.
+"""
+
+MODES = ('search', 'perft', 'moves')
+SYNC_EVERY = 1000  # results between fsyncs of the output file
+
+_OPERATION = re.compile(r'\s*([A-Za-z]\w*)\s*((?:"[^"]*"|[^;"])*);')
+
+
+"""
+(fen, operations) of an EPD or FEN line. EPD operations such as bm, am and id become lists of their operands;
+hmvc and fmvn fill in the clocks that EPD leaves out.
+"""
+def parseEpdLine(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError('expected at least 4 fields: %r' % line)
+    rest = fields[4] if len(fields) > 4 else ''
+    clocks = rest.split(None, 2)
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        # a full FEN; anything after the clocks is taken as EPD operations
+        return ' '.join(fields[:4] + clocks[:2]), _parseOperations(clocks[2] if len(clocks) > 2 else '')
+    operations = _parseOperations(rest)
+    halfmove = operations.get('hmvc', ['0'])[0]
+    fullmove = operations.get('fmvn', ['1'])[0]
+    return ' '.join(fields[:4] + [halfmove, fullmove]), operations
+
+
+def _parseOperations(text):
+    operations = {}
+    for name, operands in _OPERATION.findall(text):
+        operations[name] = [operand.strip('"') for operand in re.findall(r'"[^"]*"|\S+', operands)]
+    return operations
+
+
+"""
+(index, line) for every position line of the file ('-' for stdin), skipping blank lines and # comments. The index
+counts positions from 0 and is what results are keyed by.
+"""
+def readPositions(path):
+    stream = sys.stdin if path == '-' else open(path)
+    try:
+        index = 0
+        for line in stream:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            yield index, line
+            index += 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+_worker = {}
+
+
+def _initWorker(mode, limits, backend, hashMB):
+    _worker.update(mode=mode, limits=limits, backend=backend,
+                   searcher=Searcher(hashMB=hashMB, info=None) if mode == 'search' else None)
+
+
+"""
+The JSON-ready result for one position line. A line that cannot be read, or a position whose analysis fails, gives a
+record with an error instead.
+"""
+def analysePosition(index, line):
+    record = {'index': index}
+    try:
+        fen, operations = parseEpdLine(line)
+        cb = ChessBoard(_worker['backend'], fen)
+    except ValueError as e:
+        record.update(line=line, error=str(e))
+        return record
+    record['fen'] = fen
+    if 'id' in operations:
+        record['id'] = operations['id'][0]
+
+    mode = _worker['mode']
+    limits = _worker['limits']
+    start = time.perf_counter()
+    try:
+        if mode == 'moves':
+            moves = cb.getValidMoves()
+            record.update(count=len(moves), moves=[move.getUciNotation() for move in moves], status=cb.status())
+        elif mode == 'perft':
+            record.update(depth=limits['depth'], nodes=perft(cb, limits['depth']))
+        else:
+            searcher = _worker['searcher']
+            searcher.table.clear()  # every position is searched from scratch, so results do not depend on the batch
+            result = searcher.search(cb, limits.get('depth') or MAX_PLY, limits.get('movetime'), limits.get('nodes'))
+            record.update(score=result.score, mate=result.mateIn, depth=result.depth, nodes=result.nodes,
+                          pv=[move.getUciNotation() for move in result.pv])
+            if result.bestMove is None:
+                record.update(bestmove=None, status=cb.status())
+            else:
+                san = toSan(cb, result.bestMove)
+                record.update(bestmove=result.bestMove.getUciNotation(), san=san)
+                # EPD test suites give the best (bm) or avoided (am) moves in SAN
+                bare = san.rstrip('+#')
+                if 'bm' in operations:
+                    record['solved'] = bare in [move.rstrip('+#!?') for move in operations['bm']]
+                elif 'am' in operations:
+                    record['solved'] = bare not in [move.rstrip('+#!?') for move in operations['am']]
+    except Exception as e:  # one position the engine chokes on must not end a run over thousands
+        record['error'] = '%s: %s' % (type(e).__name__, e)
+        return record
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    return record
+
+
+def _analyseBatch(batch):
+    return [analysePosition(index, line) for index, line in batch]
+
+
+def _batches(positions, size, skip):
+    batch = []
+    for index, line in positions:
+        if index in skip:
+            continue
+        batch.append((index, line))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+"""
+Results for the positions, in input order or, with ordered=False, as they complete. At most a few batches per worker
+are queued at once, so the input is read only as fast as it is analysed. Positions whose index is in skip are left
+out.
+"""
+def analysePositions(positions, mode='search', limits=None, workers=0, backend='array', hashMB=16, batchSize=8,
+                     ordered=True, skip=()):
+    limits = limits or {}
+    batches = _batches(positions, batchSize, skip)
+    if workers <= 1:
+        _initWorker(mode, limits, backend, hashMB)
+        for batch in batches:
+            yield from _analyseBatch(batch)
+        return
+
+    window = 4 * workers
+    with multiprocessing.Pool(workers, initializer=_initWorker, initargs=(mode, limits, backend, hashMB)) as pool:
+        if ordered:
+            pending = collections.deque()
+            for batch in batches:
+                pending.append(pool.apply_async(_analyseBatch, (batch,)))
+                if len(pending) >= window:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+            return
+
+        finished = queue.Queue()
+        inFlight = 0
+        for batch in batches:
+            pool.apply_async(_analyseBatch, (batch,), callback=finished.put, error_callback=finished.put)
+            inFlight += 1
+            while inFlight >= window:
+                yield from _finished(finished.get())
+                inFlight -= 1
+        while inFlight:
+            yield from _finished(finished.get())
+            inFlight -= 1
+
+
+def _finished(outcome):
+    if isinstance(outcome, BaseException):
+        raise outcome
+    return outcome
+
+
+"""
+Indices already in an output file, for --resume. The file is read a line at a time; a last line cut short by a crash
+is cut off the file.
+"""
+def completedIndices(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        end = 0  # just past the last complete line
+        for line in f:
+            if not line.endswith(b'\n'):
+                f.truncate(end)
+                break
+            end += len(line)
+            if line.strip():
+                done.add(json.loads(line)['index'])
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse every position of an EPD or FEN file, writing JSON lines')
+    parser.add_argument('positions', help="EPD or FEN file, one position per line ('-' for stdin)")
+    parser.add_argument('-o', '--output', help='JSONL file to write (default stdout); also the resume checkpoint')
+    parser.add_argument('-m', '--mode', choices=MODES, default='search',
+                        help='search for the best move, count perft nodes, or list the legal moves')
+    parser.add_argument('-d', '--depth', type=int, help='search depth, or perft depth (default 3)')
+    parser.add_argument('-t', '--movetime', type=float, help='search seconds per position')
+    parser.add_argument('-n', '--nodes', type=int, help='search node budget per position')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (0 or 1 analyses in-process)')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='bitboard')
+    parser.add_argument('--hash', type=int, default=16, metavar='MB', help='transposition table size per worker')
+    parser.add_argument('--batch', type=int, default=8, help='positions per worker task')
+    parser.add_argument('--unordered', action='store_true', help='write results as they complete, not in input order')
+    parser.add_argument('--resume', action='store_true', help='skip positions already in the output file')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'perft':
+        limits = {'depth': args.depth or 3}
+    elif args.mode == 'search':
+        limits = {'depth': args.depth, 'movetime': args.movetime, 'nodes': args.nodes}
+        if args.depth is None and args.movetime is None and args.nodes is None:
+            limits['depth'] = 3
+    else:
+        limits = {}
+
+    skip = set()
+    if args.output is None:
+        if args.resume:
+            parser.error('--resume needs an --output file')
+        output = sys.stdout
+    else:
+        if args.resume:
+            skip = completedIndices(args.output)
+        elif os.path.exists(args.output) and os.path.getsize(args.output):
+            parser.error('%s already has results; pass --resume to continue it' % args.output)
+        output = open(args.output, 'a')
+
+    count = 0
+    errors = 0
+    start = time.perf_counter()
+    try:
+        for record in analysePositions(readPositions(args.positions), args.mode, limits, args.workers, args.backend,
+                                       args.hash, args.batch, not args.unordered, skip):
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+            count += 1
+            errors += 'error' in record
+            if count % SYNC_EVERY == 0:
+                if output is not sys.stdout:
+                    os.fsync(output.fileno())
+                elapsed = time.perf_counter() - start
+                print('%d positions in %.1fs (%.1f/sec)' % (count, elapsed, count / elapsed), file=sys.stderr)
+    except KeyboardInterrupt:
+        print('interrupted; run again with --resume to continue', file=sys.stderr)
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print('%d positions analysed%s, %d errors in %.1fs' % (
+        count, ' (%d already done)' % len(skip) if skip else '', errors, elapsed), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
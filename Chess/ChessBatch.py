@@ -0,0 +1,139 @@
+import argparse
+import random
+import time
+import numpy as np
+from ChessEngine import ChessBoard, SNAPSHOT_BYTES, SNAPSHOT_PIECES
+from ChessEvaluation import MG_SCORES, EG_SCORES, PHASES, TOTAL_PHASE, evaluateWhite
+
+"""
+Batch encoding and evaluation of many positions at once with NumPy. Positions come in as ChessBoard objects,
+ChessBoard snapshots (bytes) or an N x SNAPSHOT_BYTES uint8 array of snapshots, and are decoded into an N x 64 int8
+array of piece codes in ChessBoard.board order (square row * 8 + col). Everything after that is array arithmetic.
+"""
+
+# piece code c in the squares array is PLANE_PIECES[c - 1]; 0 is an empty square
+PLANE_PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+
+# snapshot nibble -> squares code
+_NIBBLE_CODES = np.array([PLANE_PIECES.index(piece) + 1 if piece not in (None, '--') else 0
+                          for piece in SNAPSHOT_PIECES], dtype=np.int8)
+
+
+def _scoreTable(scores):
+    table = np.zeros((len(PLANE_PIECES) + 1, 64), dtype=np.int64)
+    for code, piece in enumerate(PLANE_PIECES, 1):
+        table[code] = scores[piece]
+    return table
+
+
+MG_TABLE = _scoreTable(MG_SCORES)
+EG_TABLE = _scoreTable(EG_SCORES)
+PHASE_TABLE = np.array([0] + [PHASES[piece] for piece in PLANE_PIECES], dtype=np.int64)
+_SQUARES = np.arange(64)
+
+
+"""
+N x SNAPSHOT_BYTES uint8 array of the positions' snapshots
+"""
+def snapshotArray(positions):
+    if isinstance(positions, np.ndarray):
+        return positions.reshape(-1, SNAPSHOT_BYTES).astype(np.uint8, copy=False)
+    data = b''.join([position if isinstance(position, (bytes, bytearray)) else position.toSnapshot()
+                     for position in positions])
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, SNAPSHOT_BYTES)
+
+
+"""
+N x 64 int8 array of piece codes (see PLANE_PIECES), one row per position
+"""
+def encodeSquares(positions):
+    packed = snapshotArray(positions)[:, :32]
+    nibbles = np.empty((packed.shape[0], 64), dtype=np.uint8)
+    nibbles[:, 0::2] = packed >> 4
+    nibbles[:, 1::2] = packed & 15
+    return _NIBBLE_CODES[nibbles]
+
+
+"""
+N x 12 x 64 array with a one in plane p wherever PLANE_PIECES[p] stands
+"""
+def encodePlanes(positions, dtype=np.uint8):
+    squares = positions if isinstance(positions, np.ndarray) and positions.shape[-1] == 64 \
+        else encodeSquares(positions)
+    return (squares[:, None, :] == np.arange(1, len(PLANE_PIECES) + 1, dtype=np.int8)[None, :, None]).astype(dtype)
+
+
+"""
+N bool array, True where white is to move
+"""
+def whiteToMove(positions):
+    return (snapshotArray(positions)[:, 32] & 1) == 0
+
+
+"""
+Material plus piece-square score of every row of an N x 64 squares array, from white's side, tapered exactly like
+ChessEvaluation.evaluateWhite
+"""
+def evaluateSquares(squares):
+    squares = squares.astype(np.intp, copy=False)
+    mg = MG_TABLE[squares, _SQUARES].sum(axis=1)
+    eg = EG_TABLE[squares, _SQUARES].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[squares].sum(axis=1), TOTAL_PHASE)
+    return (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+
+"""
+Scores of a batch of positions as an int64 array: from the side to move's point of view like
+ChessEvaluation.evaluate, or from white's side with sideToMove=False
+"""
+def evaluateBatch(positions, sideToMove=True):
+    snapshots = snapshotArray(positions)
+    scores = evaluateSquares(encodeSquares(snapshots))
+    if sideToMove:
+        scores = np.where(whiteToMove(snapshots), scores, -scores)
+    return scores
+
+
+def randomPositions(count, seed=0):
+    rng = random.Random(seed)
+    snapshots = []
+    cb = ChessBoard()
+    while len(snapshots) < count:
+        moves = cb.getValidMoves()
+        if not moves or len(cb.moveLog) >= 120:
+            cb = ChessBoard()
+            continue
+        cb.makeMove(rng.choice(moves))
+        snapshots.append(cb.toSnapshot())
+    return snapshots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare batch evaluation with NumPy against the per-position loop')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='positions to score')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    snapshots = randomPositions(args.count, args.seed)
+    boards = [ChessBoard.fromSnapshot(snapshot) for snapshot in snapshots]
+
+    start = time.perf_counter()
+    expected = [evaluateWhite(cb.board) for cb in boards]
+    loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = evaluateBatch(snapshots, sideToMove=False)
+    batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planes = encodePlanes(snapshots)
+    encode = time.perf_counter() - start
+
+    print('%d positions: loop %.3fs, batch %.3fs (%.1fx), planes %s in %.3fs, %s' % (
+        len(boards), loop, batch, loop / batch if batch else 0, 'x'.join(map(str, planes.shape)), encode,
+        'scores match' if scores.tolist() == expected else 'SCORES DIFFER'))
+    return 0 if scores.tolist() == expected else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,395 @@
+from ChessEngine import ChessBoard, Move, captureOrder
+
+"""
+Bitboard backend for ChessBoard. Squares are numbered row * 8 + col, so bit 0 is a8 and bit 63 is h1, matching the
+row/column layout of ChessBoard.board. The 8x8 board is still kept up to date next to the bitboards: it is the view
+ChessMain draws from and what Move reads the moved and captured pieces from.
+
+Known shortfall: perft runs only about 2.3-2.6x faster than on the array backend (startpos depth 4, kiwipete depth
+3), well short of the 10x aimed for. Every generated move is still a Move object built from the 8x8 board, and
+makeMove updates the board, the Zobrist key and the scores alongside the bitboards, so the per-move Python overhead
+that dominates both backends remains.
+"""
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(bb):
+        return bin(bb).count('1')
+
+
+def _onBoard(r, c):
+    return 0 <= r <= 7 and 0 <= c <= 7
+
+
+def _stepTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if _onBoard(r + dr, c + dc):
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+def _ray(sq, dr, dc, occupied=0, inner=False):
+    # squares seen from sq in one direction up to and including the first occupied one; with inner set the last
+    # square before the edge is left out, since a piece there never blocks anything
+    r, c = divmod(sq, 8)
+    bb = 0
+    r += dr
+    c += dc
+    while _onBoard(r, c):
+        if inner and not _onBoard(r + dr, c + dc):
+            break
+        bit = 1 << (r * 8 + c)
+        bb |= bit
+        if occupied & bit:
+            break
+        r += dr
+        c += dc
+    return bb
+
+
+"""
+For every square and every line through it (rank, file, diagonal, anti-diagonal), map the occupancy of the squares on
+that line that can block to the squares a slider attacks along it. A line has at most six such squares, so each table
+holds at most 64 entries and a slider lookup is one mask and one dict access per line.
+"""
+def _lineTables(lines):
+    tables = []
+    for sq in range(64):
+        squareTables = []
+        for dr, dc in lines:
+            mask = _ray(sq, dr, dc, inner=True) | _ray(sq, -dr, -dc, inner=True)
+            table = {}
+            subset = 0
+            while True:
+                table[subset] = _ray(sq, dr, dc, subset) | _ray(sq, -dr, -dc, subset)
+                subset = (subset - mask) & mask
+                if subset == 0:
+                    break
+            squareTables.append((mask, table))
+        tables.append(tuple(squareTables))
+    return tables
+
+
+KNIGHT_ATTACKS = _stepTable(ChessBoard.knightJumps)
+KING_ATTACKS = _stepTable(ChessBoard.directions)
+# squares attacked by a pawn of the given colour standing on each square
+PAWN_ATTACKS = {'w': _stepTable(((-1, -1), (-1, 1))), 'b': _stepTable(((1, -1), (1, 1)))}
+ROOK_LINES = _lineTables(((0, 1), (1, 0)))
+BISHOP_LINES = _lineTables(((1, 1), (1, -1)))
+ROOK_EMPTY = [_ray(sq, 0, 1) | _ray(sq, 0, -1) | _ray(sq, 1, 0) | _ray(sq, -1, 0) for sq in range(64)]
+BISHOP_EMPTY = [_ray(sq, 1, 1) | _ray(sq, 1, -1) | _ray(sq, -1, 1) | _ray(sq, -1, -1) for sq in range(64)]
+
+
+def _betweenAndLine():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for dr, dc in ChessBoard.directions:
+            ray = 0
+            r, c = divmod(sq, 8)
+            r += dr
+            c += dc
+            while _onBoard(r, c):
+                target = r * 8 + c
+                between[sq][target] = ray
+                line[sq][target] = _ray(sq, dr, dc) | _ray(sq, -dr, -dc) | (1 << sq)
+                ray |= 1 << target
+                r += dr
+                c += dc
+    return between, line
+
+
+# squares strictly between two aligned squares, and the whole line through them (0 when they are not aligned)
+BETWEEN, LINE = _betweenAndLine()
+
+
+def rookAttacks(sq, occupied):
+    (rankMask, rankTable), (fileMask, fileTable) = ROOK_LINES[sq]
+    return rankTable[occupied & rankMask] | fileTable[occupied & fileMask]
+
+
+def bishopAttacks(sq, occupied):
+    (diagMask, diagTable), (antiMask, antiTable) = BISHOP_LINES[sq]
+    return diagTable[occupied & diagMask] | antiTable[occupied & antiMask]
+
+
+def squares(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+class BitboardChessBoard(ChessBoard):
+    """
+    ChessBoard with per-piece bitboards. makeMove/undoMove toggle the bitboards and then run the regular board
+    bookkeeping, so move logs, castling rights and check flags behave exactly as in the array backend; legal move
+    generation and attack queries are answered from the bitboards instead of by walking the 8x8 board.
+    """
+    pieceCodes = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+
+    def __init__(self, backend='bitboard', fen=None):
+        super().__init__(backend, fen)
+
+    def syncPosition(self):
+        self.bitboards = dict.fromkeys(self.pieceCodes, 0)
+        self.occupancy = {'w': 0, 'b': 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.bitboards[piece] |= 1 << (r * 8 + c)
+                    self.occupancy[piece[0]] |= 1 << (r * 8 + c)
+        super().syncPosition()
+
+    def makeMove(self, move):
+        self.toggleMove(move)
+        super().makeMove(move)
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            # toggling is its own inverse
+            self.toggleMove(self.moveLog[-1])
+        super().undoMove()
+
+    def toggleMove(self, move):
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        piece = move.pieceMoved
+        color = piece[0]
+        enemy = 'b' if color == 'w' else 'w'
+        fromBit = 1 << (move.startRow * 8 + move.startCol)
+        toBit = 1 << (move.endRow * 8 + move.endCol)
+
+        bitboards[piece] ^= fromBit | toBit
+        occupancy[color] ^= fromBit | toBit
+        if move.isEnpassantMove:
+            capturedBit = 1 << (move.startRow * 8 + move.endCol)
+            bitboards[move.pieceCaptured] ^= capturedBit
+            occupancy[enemy] ^= capturedBit
+        elif move.pieceCaptured != '--':
+            bitboards[move.pieceCaptured] ^= toBit
+            occupancy[enemy] ^= toBit
+
+        if move.isPawnPromotion:
+            bitboards[piece] ^= toBit
+            bitboards[color + 'Q'] ^= toBit
+
+        if move.isCastling:
+            rookBits = (1 << (move.startRow * 8 + (0 if move.endCol == 2 else 7))) | \
+                       (1 << (move.startRow * 8 + (3 if move.endCol == 2 else 5)))
+            bitboards[color + 'R'] ^= rookBits
+            occupancy[color] ^= rookBits
+
+    def attackedBy(self, sq, side, occupied):
+        bitboards = self.bitboards
+        if KNIGHT_ATTACKS[sq] & bitboards[side + 'N'] or KING_ATTACKS[sq] & bitboards[side + 'K'] or \
+                PAWN_ATTACKS['b' if side == 'w' else 'w'][sq] & bitboards[side + 'p']:
+            return True
+        queens = bitboards[side + 'Q']
+        return bool(rookAttacks(sq, occupied) & (bitboards[side + 'R'] | queens) or
+                    bishopAttacks(sq, occupied) & (bitboards[side + 'B'] | queens))
+
+    def attackersTo(self, sq, side, occupied):
+        bitboards = self.bitboards
+        queens = bitboards[side + 'Q']
+        return (KNIGHT_ATTACKS[sq] & bitboards[side + 'N']) | (KING_ATTACKS[sq] & bitboards[side + 'K']) | \
+            (PAWN_ATTACKS['b' if side == 'w' else 'w'][sq] & bitboards[side + 'p']) | \
+            (rookAttacks(sq, occupied) & (bitboards[side + 'R'] | queens)) | \
+            (bishopAttacks(sq, occupied) & (bitboards[side + 'B'] | queens))
+
+    def squareUnderAttack(self, square, side):
+        return self.attackedBy(square[0] * 8 + square[1], side, self.occupancy['w'] | self.occupancy['b'])
+
+    """
+    Legal destinations of the side to move as (from square, targets bitboard) pairs, plus the en passant captures and
+    castling moves as (from, to) square pairs. Promotions only ever produce a queen, so every target is one move.
+    """
+    def legalTargets(self):
+        bitboards = self.bitboards
+        ally, enemy = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        allies = self.occupancy[ally]
+        enemies = self.occupancy[enemy]
+        occupied = allies | enemies
+        kingSq = (bitboards[ally + 'K']).bit_length() - 1
+        targets = []
+        special = []
+
+        kingTargets = 0
+        withoutKing = occupied ^ (1 << kingSq)
+        for sq in squares(KING_ATTACKS[kingSq] & ~allies):
+            if not self.attackedBy(sq, enemy, withoutKing):
+                kingTargets |= 1 << sq
+        if kingTargets:
+            targets.append((kingSq, kingTargets))
+
+        checkers = self.attackersTo(kingSq, enemy, occupied)
+        self.inCheck = checkers != 0
+        if checkers & (checkers - 1):
+            # in double check only the king can move
+            return targets, special
+        if checkers:
+            checkMask = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+        else:
+            checkMask = -1
+
+        pinned = 0
+        pinLines = {}
+        enemyQueens = bitboards[enemy + 'Q']
+        snipers = (ROOK_EMPTY[kingSq] & (bitboards[enemy + 'R'] | enemyQueens)) | \
+                  (BISHOP_EMPTY[kingSq] & (bitboards[enemy + 'B'] | enemyQueens))
+        for sniper in squares(snipers):
+            blockers = BETWEEN[kingSq][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & allies:
+                pinned |= blockers
+                pinLines[blockers.bit_length() - 1] = LINE[kingSq][sniper]
+
+        movable = ~allies & checkMask
+        for sq in squares(bitboards[ally + 'N'] & ~pinned):
+            bb = KNIGHT_ATTACKS[sq] & movable
+            if bb:
+                targets.append((sq, bb))
+        for kind, attacks in (('B', bishopAttacks), ('R', rookAttacks), ('Q', None)):
+            for sq in squares(bitboards[ally + kind]):
+                if attacks is None:
+                    bb = (rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)) & movable
+                else:
+                    bb = attacks(sq, occupied) & movable
+                if pinned >> sq & 1:
+                    bb &= pinLines[sq]
+                if bb:
+                    targets.append((sq, bb))
+
+        empty = ~occupied
+        if ally == 'w':
+            step, doubleRow = -8, 6
+        else:
+            step, doubleRow = 8, 1
+        pawnAttacks = PAWN_ATTACKS[ally]
+        for sq in squares(bitboards[ally + 'p']):
+            bb = pawnAttacks[sq] & enemies
+            push = sq + step
+            if empty >> push & 1:
+                bb |= 1 << push
+                if sq >> 3 == doubleRow and empty >> (push + step) & 1:
+                    bb |= 1 << (push + step)
+            bb &= checkMask
+            if pinned >> sq & 1:
+                bb &= pinLines[sq]
+            if bb:
+                targets.append((sq, bb))
+
+        if self.enpassantPossible != ():
+            epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+            capturedSq = epSq - step
+            for sq in squares(PAWN_ATTACKS[enemy][epSq] & bitboards[ally + 'p']):
+                # play it out on the occupancy: this covers pins, checks and the two pawns leaving one rank at once
+                after = occupied ^ (1 << sq) ^ (1 << capturedSq) ^ (1 << epSq)
+                bitboards[enemy + 'p'] ^= 1 << capturedSq
+                exposed = self.attackedBy(kingSq, enemy, after)
+                bitboards[enemy + 'p'] ^= 1 << capturedSq
+                if not exposed:
+                    special.append((sq, epSq))
+
+        if not checkers:
+            r = kingSq >> 3
+            if ally == 'w':
+                queenSide, kingSide = self.currentCastlingRight.wqs, self.currentCastlingRight.wks
+            else:
+                queenSide, kingSide = self.currentCastlingRight.bqs, self.currentCastlingRight.bks
+            rooks = bitboards[ally + 'R']
+            if kingSq == r * 8 + 4 and r == (7 if ally == 'w' else 0):
+                if queenSide and rooks >> (kingSq - 4) & 1 and not occupied & (0b111 << (kingSq - 3)) and \
+                        not self.attackedBy(kingSq - 1, enemy, occupied) and \
+                        not self.attackedBy(kingSq - 2, enemy, occupied):
+                    special.append((kingSq, kingSq - 2))
+                if kingSide and rooks >> (kingSq + 3) & 1 and not occupied & (0b11 << (kingSq + 1)) and \
+                        not self.attackedBy(kingSq + 1, enemy, occupied) and \
+                        not self.attackedBy(kingSq + 2, enemy, occupied):
+                    special.append((kingSq, kingSq + 2))
+
+        return targets, special
+
+    def getValidMoves(self, moves=None):
+        targets, special = self.legalTargets()
+        board = self.board
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        for fromSq, bb in targets:
+            start = divmod(fromSq, 8)
+            for toSq in squares(bb):
+                moves.append(Move(start, divmod(toSq, 8), board))
+        for fromSq, toSq in special:
+            start = divmod(fromSq, 8)
+            end = divmod(toSq, 8)
+            moves.append(Move(start, end, board, isEnpassantMove=board[start[0]][start[1]][1] == 'p'))
+
+        self.checkmate = len(moves) == 0 and self.inCheck
+        self.stalemate = len(moves) == 0 and not self.inCheck
+        return moves
+
+    """
+    The staged generator of ChessBoard.generateMoves on top of legalTargets: every target is legal already, so the
+    stages only decide which targets become Move objects and when
+    """
+    def generateMoves(self, hashMove=0, orderCaptures=True, quiets=True, quietOrder=None):
+        targets, special = self.legalTargets()
+        board = self.board
+        enemies = self.occupancy['b' if self.whiteToMove else 'w']
+        pawns = self.bitboards['wp' if self.whiteToMove else 'bp']
+        promotions = 0xFF if self.whiteToMove else 0xFF << 56
+
+        first = None
+        if hashMove:
+            fromSq, toSq = hashMove & 63, hashMove >> 6 & 63
+            for sq, bb in targets:
+                if sq == fromSq and bb >> toSq & 1:
+                    first = Move(divmod(fromSq, 8), divmod(toSq, 8), board)
+            if (fromSq, toSq) in special:
+                first = Move(divmod(fromSq, 8), divmod(toSq, 8), board, isEnpassantMove=pawns >> fromSq & 1 == 1)
+            if first is not None and first.encoded == hashMove:
+                yield first
+            else:
+                first = None
+
+        captures = []
+        for fromSq, bb in targets:
+            start = divmod(fromSq, 8)
+            for toSq in squares(bb & (enemies | promotions if pawns >> fromSq & 1 else enemies)):
+                captures.append(Move(start, divmod(toSq, 8), board))
+        for fromSq, toSq in special:
+            if pawns >> fromSq & 1:
+                captures.append(Move(divmod(fromSq, 8), divmod(toSq, 8), board, isEnpassantMove=True))
+        if orderCaptures:
+            captures.sort(key=captureOrder, reverse=True)
+        for move in captures:
+            if move != first:
+                yield move
+        if not quiets:
+            return
+
+        moves = []
+        for fromSq, bb in targets:
+            start = divmod(fromSq, 8)
+            for toSq in squares(bb & ~(enemies | promotions if pawns >> fromSq & 1 else enemies)):
+                moves.append(Move(start, divmod(toSq, 8), board))
+        for fromSq, toSq in special:
+            if not pawns >> fromSq & 1:
+                moves.append(Move(divmod(fromSq, 8), divmod(toSq, 8), board))
+        if quietOrder is not None:
+            moves.sort(key=quietOrder, reverse=True)
+        for move in moves:
+            if move != first:
+                yield move
+
+    def countValidMoves(self):
+        targets, special = self.legalTargets()
+        return sum([popcount(bb) for _, bb in targets]) + len(special)
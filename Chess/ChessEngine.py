@@ -1,8 +1,81 @@
-from copy import deepcopy
+import random
+import struct
+from ChessEvaluation import MG_SCORES, EG_SCORES, PHASES, scoreBoard
+
+"""
+Zobrist keys: one random 64-bit number per piece and square, for black to move, for each castling right and for each
+en passant file. A position's key is the XOR of the numbers for everything in it, so makeMove can update it with a few
+XORs. The seed is fixed so keys are the same in every process.
+"""
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = {piece: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                  for piece in ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = {right: _zobristRandom.getrandbits(64) for right in ('wqs', 'wks', 'bqs', 'bks')}
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)]
+
+# what ChessBoard.status() reports
+ONGOING = 'ongoing'
+CHECKMATE = 'checkmate'
+STALEMATE = 'stalemate'
+FIFTY_MOVES = 'fifty-move rule'
+REPETITION = 'threefold repetition'
+
+LEGAL_MOVE_CACHE_SIZE = 1 << 16
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+"""
+Binary snapshot of a position, 38 bytes: the 64 squares as 4-bit piece codes two to a byte in board order, a flags
+byte (bit 0 black to move, bits 1-4 castling rights wqs, wks, bqs, bks), the en passant square (row * 8 + col, 255
+for none), then the halfmove clock and the fullmove number as little-endian 16-bit ints
+"""
+SNAPSHOT_PIECES = ('--', 'wp', 'wN', 'wB', 'wR', 'wQ', 'wK', None, None, 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK', None)
+SNAPSHOT_CODES = {piece: code for code, piece in enumerate(SNAPSHOT_PIECES) if piece is not None}
+_SNAPSHOT_PAIRS = [(SNAPSHOT_PIECES[byte >> 4], SNAPSHOT_PIECES[byte & 15]) for byte in range(256)]
+SNAPSHOT_FORMAT = struct.Struct('<32sBBHH')
+SNAPSHOT_BYTES = SNAPSHOT_FORMAT.size
+
+
+# rough piece values for ordering captures, most valuable victim first and least valuable attacker breaking ties
+ORDER_VALUES = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0}
+
+
+"""
+MVV-LVA key of a capture or promotion; the staged generators and the search's move ordering both sort by it
+"""
+def captureOrder(move):
+    score = 10 * ORDER_VALUES[move.pieceCaptured[1]] - ORDER_VALUES[move.pieceMoved[1]] \
+        if move.pieceCaptured != '--' else 0
+    if move.isPawnPromotion:
+        score += 10 * ORDER_VALUES['Q']
+    return score
 
 
 class ChessBoard:
-    def __init__(self):
+    # orthogonal directions first, then diagonals
+    directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+    knightJumps = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+    slideDirections = {'R': directions[:4], 'B': directions[4:], 'Q': directions}
+    # the per-piece move generator for each kind of piece
+    moveFunctionNames = {'K': 'getKingMoves', 'Q': 'getQueenMoves', 'R': 'getRookMoves', 'N': 'getKnightMoves',
+                         'B': 'getBishopMoves', 'p': 'getPawnMoves'}
+
+    """
+    backend picks the board representation: 'array' walks the 8x8 board below, 'bitboard' generates moves from
+    per-piece bitboards (see ChessBitboard). Both expose the same methods and the same board view. fen sets up a
+    position other than the starting one.
+    """
+    def __new__(cls, backend='array', fen=None):
+        if backend == 'bitboard' and cls is ChessBoard:
+            from ChessBitboard import BitboardChessBoard  # imported here since it subclasses ChessBoard
+            cls = BitboardChessBoard
+        elif backend not in ('array', 'bitboard'):
+            raise ValueError('unknown board backend: %r' % (backend,))
+        return super().__new__(cls)
+
+    def __init__(self, backend='array', fen=None):
+        self.backend = backend
         self.whiteToMove = True
         self.board = [
             ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
@@ -14,42 +87,271 @@ class ChessBoard:
             ['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
             ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
         ]
-        """self.board = [
-            ['--', '--', '--', '--', '--', '--', '--', 'bK'],
-            ['--', '--', '--', '--', '--', 'wK', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', 'wQ', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['--', '--', '--', 'wp', '--', '--', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--']
-        ]"""
         self.moveLog = []
         self.moveCount = 1
-        self.moveFunctions = {
-            'K': self.getKingMoves, 'Q': self.getQueenMoves, 'R': self.getRookMoves,
-            'N': self.getKnightMoves, 'B': self.getBishopMoves, 'p': self.getPawnMoves,
-        }
+        self.bindMoveFunctions()
         self.blackKingInCheck = False
         self.whiteKingInCheck = False
+        self.inCheck = False
+        self.pins = {}
+        self.checks = []
         self.currentCastlingRight = CastlingRights(True, True, True, True)
-        self.castlingRightsLog = [deepcopy(self.currentCastlingRight)]
+        self.undoStack = []
+        self.halfmoveClock = 0  # plies since the last capture or pawn move
 
         self.blackKingPosition = None
         self.whiteKingPosition = None
         self.checkmate = False
         self.stalemate = False
+        self.legalMoveCache = {}  # zobristKey -> whether the side to move has a legal move
 
         self.enpassantPossible = ()  # Coordinates where enpassant is possible
+        if fen is None:
+            self.syncPosition()
+        else:
+            self.loadFen(fen)
+
+    """
+    Look the per-piece move generators up afresh, so moveFunctions follows methods replaced on the class, such as the
+    instrumented ones of ChessProfile
+    """
+    def bindMoveFunctions(self):
+        self.moveFunctions = {kind: getattr(self, name) for kind, name in self.moveFunctionNames.items()}
+
+    """
+    Set up the position from a FEN string, forgetting the game so far
+    """
+    def loadFen(self, fen):
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError('bad FEN: %r' % (fen,))
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(['--'] * int(char))
+                elif char.lower() in 'pnbrqk':
+                    row.append(('w' if char.isupper() else 'b') + (char.upper() if char.lower() != 'p' else 'p'))
+                else:
+                    raise ValueError('bad FEN piece %r: %r' % (char, fen))
+            if len(row) != 8:
+                raise ValueError('bad FEN rank %r: %r' % (rank, fen))
+            board.append(row)
+        if len(board) != 8:
+            raise ValueError('bad FEN, %d ranks: %r' % (len(board), fen))
+
+        side = fields[1] if len(fields) > 1 else 'w'
+        if side not in ('w', 'b'):
+            raise ValueError('bad FEN side to move %r: %r' % (side, fen))
+        whiteToMove = side == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        if castling != '-' and (not castling or set(castling) - set('KQkq')):
+            raise ValueError('bad FEN castling rights %r: %r' % (castling, fen))
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        if enpassant == '-':
+            enpassantPossible = ()
+        elif len(enpassant) == 2 and enpassant[0] in 'abcdefgh' and enpassant[1] == ('6' if whiteToMove else '3'):
+            enpassantPossible = (8 - int(enpassant[1]), ord(enpassant[0]) - ord('a'))
+        else:
+            raise ValueError('bad FEN en passant square %r: %r' % (enpassant, fen))
+        clocks = fields[4:6]
+        if not all([clock.isdigit() for clock in clocks]):
+            raise ValueError('bad FEN move clocks %r: %r' % (' '.join(clocks), fen))
+        try:
+            self.checkPosition(board, whiteToMove)
+        except ValueError as e:
+            raise ValueError('bad FEN, %s: %r' % (e, fen))
+        # an en passant square no pawn can have just skipped, and rights whose king or rook has left its home
+        # square, are dropped rather than rejected
+        if enpassantPossible and not self.enpassantPlausible(board, enpassantPossible, whiteToMove):
+            enpassantPossible = ()
+        whiteHome = board[7][4] == 'wK'
+        blackHome = board[0][4] == 'bK'
+        rights = CastlingRights('Q' in castling and whiteHome and board[7][0] == 'wR',
+                                'K' in castling and whiteHome and board[7][7] == 'wR',
+                                'q' in castling and blackHome and board[0][0] == 'bR',
+                                'k' in castling and blackHome and board[0][7] == 'bR')
+        self.setPosition(board, whiteToMove, rights, enpassantPossible, int(clocks[0]) if clocks else 0,
+                         max(1, int(clocks[1])) if len(clocks) > 1 else 1)
+        return self
+
+    """
+    Raise ValueError unless board is a position ChessBoard can play from: one king a side, no pawns on the first or
+    last rank, and the side that has just moved not left in check
+    """
+    @staticmethod
+    def checkPosition(board, whiteToMove):
+        pieces = [piece for row in board for piece in row]
+        for king in ('wK', 'bK'):
+            if pieces.count(king) != 1:
+                raise ValueError('%d %s kings, expected one' % (
+                    pieces.count(king), 'white' if king == 'wK' else 'black'))
+        if 'wp' in board[0] + board[7] or 'bp' in board[0] + board[7]:
+            raise ValueError('pawn on the first or last rank')
+        # the array attack test only reads the board, so a bare instance answers it without touching self
+        probe = object.__new__(ChessBoard)
+        probe.board = board
+        waiting = 'bK' if whiteToMove else 'wK'
+        square = divmod(pieces.index(waiting), 8)
+        if probe.squareUnderAttack(square, 'w' if whiteToMove else 'b'):
+            raise ValueError('the side not to move is in check')
+
+    """
+    Whether a pawn of the side that has just moved can have skipped square with a double push: the pawn stands in
+    front of it and both the square and the one the pawn came from are empty
+    """
+    @staticmethod
+    def enpassantPlausible(board, square, whiteToMove):
+        r, c = square
+        if whiteToMove:
+            return r == 2 and board[3][c] == 'bp' and board[2][c] == '--' and board[1][c] == '--'
+        return r == 5 and board[4][c] == 'wp' and board[5][c] == '--' and board[6][c] == '--'
+
+    def toFen(self):
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            rows.append(text + (str(empty) if empty else ''))
+
+        rights = self.currentCastlingRight
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + \
+            ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+        if self.enpassantPossible == ():
+            enpassant = '-'
+        else:
+            enpassant = 'abcdefgh'[self.enpassantPossible[1]] + str(8 - self.enpassantPossible[0])
+        return '%s %s %s %s %d %d' % ('/'.join(rows), 'w' if self.whiteToMove else 'b', castling or '-', enpassant,
+                                      self.halfmoveClock, (self.moveCount + 1) // 2)
+
+    """
+    Set up the position from a SNAPSHOT_BYTES long snapshot, forgetting the game so far
+    """
+    def loadSnapshot(self, data):
+        if len(data) != SNAPSHOT_BYTES:
+            raise ValueError('snapshot must be %d bytes, got %d' % (SNAPSHOT_BYTES, len(data)))
+        squares, flags, enpassant, halfmoveClock, fullmove = SNAPSHOT_FORMAT.unpack(data)
+        pairs = [_SNAPSHOT_PAIRS[byte] for byte in squares]
+        board = [[piece for pair in pairs[r:r + 4] for piece in pair] for r in range(0, 32, 4)]
+        for row in board:
+            if None in row:
+                raise ValueError('bad piece code in snapshot')
+        whiteToMove = not flags & 1
+        self.checkPosition(board, whiteToMove)
+        enpassantPossible = () if enpassant == 255 else divmod(enpassant, 8)
+        if enpassantPossible and (enpassant > 63 or not self.enpassantPlausible(board, enpassantPossible, whiteToMove)):
+            raise ValueError('bad en passant square %d in snapshot' % enpassant)
+        if fullmove < 1:
+            raise ValueError('bad fullmove number %d in snapshot' % fullmove)
+        self.setPosition(board, whiteToMove,
+                         CastlingRights(bool(flags & 2), bool(flags & 4), bool(flags & 8), bool(flags & 16)),
+                         enpassantPossible, halfmoveClock, fullmove)
+        return self
+
+    def toSnapshot(self):
+        codes = SNAPSHOT_CODES
+        squares = bytes([codes[row[c]] << 4 | codes[row[c + 1]] for row in self.board for c in range(0, 8, 2)])
+        rights = self.currentCastlingRight
+        flags = (0 if self.whiteToMove else 1) | rights.wqs << 1 | rights.wks << 2 | rights.bqs << 3 | rights.bks << 4
+        enpassant = 255 if self.enpassantPossible == () else self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        return SNAPSHOT_FORMAT.pack(squares, flags, enpassant, self.halfmoveClock, (self.moveCount + 1) // 2)
+
+    @classmethod
+    def fromSnapshot(cls, data, backend='array'):
+        return cls(backend).loadSnapshot(data)
+
+    def setPosition(self, board, whiteToMove, castlingRights, enpassantPossible, halfmoveClock=0, fullmove=1):
+        self.board = board
+        self.whiteToMove = whiteToMove
+        self.currentCastlingRight = castlingRights
+        self.enpassantPossible = enpassantPossible
+        self.halfmoveClock = halfmoveClock
+        self.moveCount = 2 * fullmove - (1 if whiteToMove else 0)
+        self.moveLog = []
+        self.undoStack = []
+        self.checkmate = False
+        self.stalemate = False
+        self.syncPosition()
+
+    """
+    Recompute everything derived from self.board, after the board has been set up or replaced wholesale
+    """
+    def syncPosition(self):
         self.updateKingPosition()
+        self.checkCheck()
+        self.zobristKey = self.computeZobristKey()
+        # material plus piece-square totals from white's side and the game phase, kept up to date by makeMove
+        self.mgScore, self.egScore, self.phase = scoreBoard(self.board)
+        self.pieceCount = 64 - sum([row.count('--') for row in self.board])  # kings included
+        # how often each position has occurred, for threefold repetition; earlier history is not known here
+        self.positionCounts = {self.zobristKey: 1}
+
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != '--':
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r * 8 + c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ self.castlingHash(self.currentCastlingRight) ^ self.enpassantHash()
+
+    @staticmethod
+    def castlingHash(rights):
+        key = 0
+        if rights.wqs:
+            key ^= ZOBRIST_CASTLING['wqs']
+        if rights.wks:
+            key ^= ZOBRIST_CASTLING['wks']
+        if rights.bqs:
+            key ^= ZOBRIST_CASTLING['bqs']
+        if rights.bks:
+            key ^= ZOBRIST_CASTLING['bks']
+        return key
+
+    """
+    The en passant file only counts towards the key when the side to move has a pawn that could take, so positions
+    that differ only in an unusable en passant square hash alike
+    """
+    def enpassantHash(self):
+        if self.enpassantPossible == ():
+            return 0
+        r, c = self.enpassantPossible
+        pawnRow, pawn = (r + 1, 'wp') if self.whiteToMove else (r - 1, 'bp')
+        if (c > 0 and self.board[pawnRow][c - 1] == pawn) or (c < 7 and self.board[pawnRow][c + 1] == pawn):
+            return ZOBRIST_ENPASSANT[c]
+        return 0
 
     def makeMove(self, move):
+        # everything undoMove cannot recompute from the move itself, one tuple per ply
+        self.undoStack.append((self.currentCastlingRight, self.enpassantPossible, move.pieceCaptured,
+                               self.halfmoveClock, self.whiteKingInCheck, self.blackKingInCheck, self.zobristKey,
+                               self.mgScore, self.egScore, self.phase))
+        castlingRights = self.currentCastlingRight
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ self.enpassantHash()
         self.board[move.startRow][move.startCol] = '--'
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)
         self.whiteToMove = not self.whiteToMove
         self.moveCount += 1
 
+        if move.pieceMoved[1] == 'K':
+            self.setKingPosition(move.pieceMoved[0], (move.endRow, move.endCol))
+
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+
         # pawn promotion
         if move.isPawnPromotion:
             self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
@@ -66,88 +368,442 @@ class ChessBoard:
 
         # update castling rights:
         self.updateCastleRights(move)
-        self.castlingRightsLog.append(CastlingRights(self.currentCastlingRight.wqs, self.currentCastlingRight.wks,
-                                                     self.currentCastlingRight.bqs, self.currentCastlingRight.bks))
+        if self.currentCastlingRight is not castlingRights:
+            key ^= self.castlingHash(castlingRights) ^ self.castlingHash(self.currentCastlingRight)
+
+        # the key and the scores change by what left and what arrived on each square
+        fromSq = move.startRow * 8 + move.startCol
+        toSq = move.endRow * 8 + move.endCol
+        placed = self.board[move.endRow][move.endCol]  # the queen, after a promotion
+        key ^= ZOBRIST_PIECES[move.pieceMoved][fromSq] ^ ZOBRIST_PIECES[placed][toSq]
+        mg = self.mgScore - MG_SCORES[move.pieceMoved][fromSq] + MG_SCORES[placed][toSq]
+        eg = self.egScore - EG_SCORES[move.pieceMoved][fromSq] + EG_SCORES[placed][toSq]
+        phase = self.phase + PHASES[placed] - PHASES[move.pieceMoved]
+        if move.pieceCaptured != '--':
+            capturedSq = move.startRow * 8 + move.endCol if move.isEnpassantMove else toSq
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][capturedSq]
+            mg -= MG_SCORES[move.pieceCaptured][capturedSq]
+            eg -= EG_SCORES[move.pieceCaptured][capturedSq]
+            phase -= PHASES[move.pieceCaptured]
+            self.pieceCount -= 1
 
         # castling
         if move.isCastling:
-            self.board[move.startRow][3 if move.endCol == 2 else 5] = move.pieceMoved[0] + 'R'
-            self.board[move.startRow][0 if move.endCol == 2 else 7] = '--'
+            rook = move.pieceMoved[0] + 'R'
+            rookFrom = move.startRow * 8 + (0 if move.endCol == 2 else 7)
+            rookTo = move.startRow * 8 + (3 if move.endCol == 2 else 5)
+            self.board[move.startRow][rookTo & 7] = rook
+            self.board[move.startRow][rookFrom & 7] = '--'
+            key ^= ZOBRIST_PIECES[rook][rookTo] ^ ZOBRIST_PIECES[rook][rookFrom]
+            mg += MG_SCORES[rook][rookTo] - MG_SCORES[rook][rookFrom]
+            eg += EG_SCORES[rook][rookTo] - EG_SCORES[rook][rookFrom]
 
-        self.checkCheck()
+        self.mgScore = mg
+        self.egScore = eg
+        self.phase = phase
+        self.zobristKey = key = key ^ self.enpassantHash()
+        self.positionCounts[key] = self.positionCounts.get(key, 0) + 1
+
+        # a legal move never leaves the mover in check, so only the other king needs looking at
+        if self.whiteToMove:
+            self.blackKingInCheck = False
+            self.whiteKingInCheck = self.squareUnderAttack(self.whiteKingPosition, 'b')
+        else:
+            self.whiteKingInCheck = False
+            self.blackKingInCheck = self.squareUnderAttack(self.blackKingPosition, 'w')
     """
     Undo the last move made
     """
     def undoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
+            count = self.positionCounts[self.zobristKey]
+            if count == 1:
+                del self.positionCounts[self.zobristKey]
+            else:
+                self.positionCounts[self.zobristKey] = count - 1
+            self.currentCastlingRight, self.enpassantPossible, captured, self.halfmoveClock, \
+                self.whiteKingInCheck, self.blackKingInCheck, self.zobristKey, \
+                self.mgScore, self.egScore, self.phase = self.undoStack.pop()
             self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.board[move.endRow][move.endCol] = captured
+            if captured != '--':
+                self.pieceCount += 1
 
             self.moveCount -= 1
+            if move.pieceMoved[1] == 'K':
+                self.setKingPosition(move.pieceMoved[0], (move.startRow, move.startCol))
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '--'
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            # undoing a 2 square pawn advance
-            if move.pieceMoved[1] == 'p' and abs(move.endRow - move.startRow) == 2:
-                self.enpassantPossible = ()
-
-            self.castlingRightsLog.pop()
-            self.currentCastlingRight = deepcopy(self.castlingRightsLog[-1])
+                self.board[move.startRow][move.endCol] = captured
 
             if move.isCastling:
                 self.board[move.startRow][0 if move.endCol == 2 else 7] = move.pieceMoved[0] + 'R'
                 self.board[move.startRow][3 if move.endCol == 2 else 5] = '--'
 
-            self.checkCheck()
             self.whiteToMove = not self.whiteToMove
     """
-    All moves considering checks
-    """
-    def getValidMoves(self):
-        # print(self.currentCastlingRight.wks, self.currentCastlingRight.wqs)
-        moves = self.getAllPossibleMoves()
-        tempEnpassantPossible = self.enpassantPossible
-
-        for move in moves[::-1]:
-            self.makeMove(move)
-            if (not self.whiteToMove and self.whiteKingInCheck) or (self.whiteToMove and self.blackKingInCheck):
-                moves.remove(move)
-            self.undoMove()
-
-        if len(moves) == 0:
-            if self.whiteToMove and self.whiteKingInCheck:
-                self.checkmate = True
-                print('black won!')
-            elif not self.whiteToMove and self.blackKingInCheck:
-                self.checkmate = True
-                print('white won!')
+    All moves considering checks. Passing a list reuses it as the buffer for the result instead of allocating one.
+    """
+    def getValidMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.whiteToMove:
+            ally = 'w'
+            kingRow, kingCol = self.whiteKingPosition
+        else:
+            ally = 'b'
+            kingRow, kingCol = self.blackKingPosition
+
+        if len(self.checks) < 2:
+            # in double check only the king can move
+            for r in range(len(self.board)):
+                for c in range(len(self.board[r])):
+                    piece = self.board[r][c]
+                    if piece[0] == ally and piece[1] != 'K':
+                        pin = self.pins.get((r, c))
+                        if pin is None:
+                            self.moveFunctions[piece[1]](r, c, moves)
+                        elif piece[1] != 'N':
+                            # a pinned piece may only slide along the line of the pin
+                            moves.extend([move for move in self.moveFunctions[piece[1]](r, c, [])
+                                          if (move.endRow - r) * pin[1] == (move.endCol - c) * pin[0]])
+
+            inCheck = self.inCheck
+            if inCheck or self.enpassantPossible != ():
+                if inCheck:
+                    checkRow, checkCol = self.checks[0][:2]
+                    validSquares = self.getCheckBlockSquares(kingRow, kingCol, self.checks[0])
+                # filtered in place with a write index, so a caller's buffer is kept rather than replaced
+                kept = 0
+                for move in moves:
+                    if move.isEnpassantMove:
+                        # en passant removes two pieces from the same rank, which a pin check on either one alone
+                        # can miss; in check it has to take the checker or block
+                        keep = self.isEnpassantLegal(move) and (
+                            not inCheck or (move.startRow, move.endCol) == (checkRow, checkCol) or
+                            (move.endRow, move.endCol) in validSquares)
+                    else:
+                        keep = not inCheck or (move.endRow, move.endCol) in validSquares
+                    if keep:
+                        moves[kept] = move
+                        kept += 1
+                del moves[kept:]
+
+        self.getKingMoves(kingRow, kingCol, moves, legalOnly=True)
+        if not self.inCheck:
+            self.getCastleMoves(kingRow, kingCol, moves)
+
+        self.checkmate = len(moves) == 0 and self.inCheck
+        self.stalemate = len(moves) == 0 and not self.inCheck
+        return moves
+
+    def countValidMoves(self):
+        return len(self.getValidMoves())
+
+    """
+    Whether the side to move has any legal move. Stops at the first one the staged generator finds and remembers
+    the answer for the position, so asking again after every move of a game costs a dictionary lookup.
+    """
+    def hasLegalMove(self):
+        found = self.legalMoveCache.get(self.zobristKey)
+        if found is None:
+            found = next(self.generateMoves(), None) is not None
+            if len(self.legalMoveCache) >= LEGAL_MOVE_CACHE_SIZE:
+                self.legalMoveCache.clear()
+            self.legalMoveCache[self.zobristKey] = found
+        return found
+
+    """
+    ONGOING, CHECKMATE, STALEMATE, FIFTY_MOVES or REPETITION for the current position. Draws by the fifty-move rule
+    and threefold repetition are reported as soon as they can be claimed.
+    """
+    def status(self):
+        if not self.hasLegalMove():
+            inCheck = self.whiteKingInCheck if self.whiteToMove else self.blackKingInCheck
+            self.checkmate = inCheck
+            self.stalemate = not inCheck
+            return CHECKMATE if inCheck else STALEMATE
+        self.checkmate = self.stalemate = False
+        if self.halfmoveClock >= 100:
+            return FIFTY_MOVES
+        if self.positionCounts.get(self.zobristKey, 0) >= 3:
+            return REPETITION
+        return ONGOING
+
+    """
+    Legal moves in stages, each generated only once the consumer has used up the one before: the hash move (a
+    Move.encoded int, skipped unless it is legal here), then captures and promotions, most valuable victim first when
+    orderCaptures is set, then quiet moves, sorted by quietOrder when one is given. A consumer that stops early, at a
+    beta cutoff or as soon as it knows there is a legal move, never pays for the later stages. Unlike getValidMoves
+    this leaves checkmate and stalemate alone.
+    """
+    def generateMoves(self, hashMove=0, orderCaptures=True, quiets=True, quietOrder=None):
+        # kept local rather than on self: the consumer may generate moves deeper in the tree between two yields
+        legality = self.getLegality()
+        first = self.getPseudoLegalMove(hashMove) if hashMove else None
+        if first is not None:
+            if self.isLegalMove(first, legality):
+                yield first
             else:
-                self.stalemate = True
-                print('stalemate!')
+                first = None
+
+        captures = self.getStageMoves(True, [])
+        if orderCaptures:
+            captures.sort(key=captureOrder, reverse=True)
+        for move in captures:
+            if move != first and self.isLegalMove(move, legality):
+                yield move
+        if not quiets:
+            return
 
-        self.enpassantPossible = tempEnpassantPossible
-        # print(self.currentCastlingRight.wks, self.currentCastlingRight.wqs)
+        moves = self.getStageMoves(False, [])
+        if not legality[0]:
+            kingRow, kingCol = self.whiteKingPosition if self.whiteToMove else self.blackKingPosition
+            self.getCastleMoves(kingRow, kingCol, moves)
+        if quietOrder is not None:
+            moves.sort(key=quietOrder, reverse=True)
+        for move in moves:
+            if move != first and self.isLegalMove(move, legality):
+                yield move
+
+    """
+    (inCheck, pins, checks, squares that stop a single check or None) for the side to move
+    """
+    def getLegality(self):
+        inCheck, pins, checks = self.checkForPinsAndChecks()
+        validSquares = None
+        if len(checks) == 1:
+            kingRow, kingCol = self.whiteKingPosition if self.whiteToMove else self.blackKingPosition
+            validSquares = self.getCheckBlockSquares(kingRow, kingCol, checks[0])
+        return inCheck, pins, checks, validSquares
+
+    """
+    Whether a pseudo-legal move keeps the mover's king safe, given getLegality() for the position
+    """
+    def isLegalMove(self, move, legality):
+        inCheck, pins, checks, validSquares = legality
+        if move.pieceMoved[1] == 'K':
+            # castling moves only come from getCastleMoves, which has already checked the king's path
+            return move.isCastling or not self.kingSquareAttacked(move.endRow, move.endCol)
+        if len(checks) > 1:
+            return False
+        pin = pins.get((move.startRow, move.startCol))
+        if pin is not None and (move.pieceMoved[1] == 'N' or
+                                (move.endRow - move.startRow) * pin[1] != (move.endCol - move.startCol) * pin[0]):
+            return False
+        if validSquares is not None and (move.endRow, move.endCol) not in validSquares and \
+                not (move.isEnpassantMove and (move.startRow, move.endCol) == checks[0][:2]):
+            return False
+        return not move.isEnpassantMove or self.isEnpassantLegal(move)
+
+    """
+    The move with this packed encoding if the side to move's piece on its start square can make it, else None.
+    Hash moves come from a table indexed by part of the key, so they may belong to a different position.
+    """
+    def getPseudoLegalMove(self, encoded):
+        startRow, startCol = divmod(encoded & 63, 8)
+        piece = self.board[startRow][startCol]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        moves = self.moveFunctions[piece[1]](startRow, startCol, [])
+        if piece[1] == 'K':
+            self.getCastleMoves(startRow, startCol, moves)
+        for move in moves:
+            if move.encoded == encoded:
+                return move
+        return None
+
+    """
+    Squares a piece can move to to stop a check: the checking piece itself and, for a slider, the line up to the king
+    """
+    def getCheckBlockSquares(self, kingRow, kingCol, check):
+        checkRow, checkCol, dirRow, dirCol = check
+        if self.board[checkRow][checkCol][1] == 'N':
+            return {(checkRow, checkCol)}
+        validSquares = set()
+        for i in range(1, 8):
+            square = (kingRow + dirRow * i, kingCol + dirCol * i)
+            validSquares.add(square)
+            if square == (checkRow, checkCol):
+                break
+        return validSquares
+
+    """
+    Pseudo-legal moves of the side to move, either only captures and promotions (tactical) or only the rest, so
+    that one kind can be generated without allocating the other. Castling is left to getCastleMoves.
+    """
+    def getStageMoves(self, tactical, moves):
+        board = self.board
+        ally, enemy = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        forward, startRow, lastRow = (-1, 6, 0) if ally == 'w' else (1, 1, 7)
+        for r in range(8):
+            row = board[r]
+            for c in range(8):
+                piece = row[c]
+                if piece[0] != ally:
+                    continue
+                kind = piece[1]
+                if kind == 'p':
+                    endRow = r + forward
+                    if tactical:
+                        for endCol in (c - 1, c + 1):
+                            if 0 <= endCol <= 7:
+                                if board[endRow][endCol][0] == enemy:
+                                    moves.append(Move((r, c), (endRow, endCol), board))
+                                elif (endRow, endCol) == self.enpassantPossible:
+                                    moves.append(Move((r, c), (endRow, endCol), board, isEnpassantMove=True))
+                        if endRow == lastRow and board[endRow][c] == '--':
+                            moves.append(Move((r, c), (endRow, c), board))
+                    elif endRow != lastRow and board[endRow][c] == '--':
+                        moves.append(Move((r, c), (endRow, c), board))
+                        if r == startRow and board[endRow + forward][c] == '--':
+                            moves.append(Move((r, c), (endRow + forward, c), board))
+                elif kind in self.slideDirections:
+                    for dirRow, dirCol in self.slideDirections[kind]:
+                        endRow = r + dirRow
+                        endCol = c + dirCol
+                        while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                            target = board[endRow][endCol]
+                            if target != '--':
+                                if tactical and target[0] == enemy:
+                                    moves.append(Move((r, c), (endRow, endCol), board))
+                                break
+                            if not tactical:
+                                moves.append(Move((r, c), (endRow, endCol), board))
+                            endRow += dirRow
+                            endCol += dirCol
+                else:
+                    for dirRow, dirCol in (self.knightJumps if kind == 'N' else self.directions):
+                        endRow = r + dirRow
+                        endCol = c + dirCol
+                        if 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                            target = board[endRow][endCol]
+                            if (target[0] == enemy) if tactical else target == '--':
+                                moves.append(Move((r, c), (endRow, endCol), board))
         return moves
 
+    """
+    Scan outward from the king of the side to move for checking pieces and for allied pieces pinned against it.
+    Pins are keyed by square and hold the direction from the king towards the pinned piece.
+    """
+    def checkForPinsAndChecks(self):
+        pins = {}
+        checks = []
+        if self.whiteToMove:
+            enemy, ally = 'b', 'w'
+            startRow, startCol = self.whiteKingPosition
+        else:
+            enemy, ally = 'w', 'b'
+            startRow, startCol = self.blackKingPosition
+
+        for j, (dirRow, dirCol) in enumerate(self.directions):
+            possiblePin = None
+            for i in range(1, 8):
+                endRow = startRow + dirRow * i
+                endCol = startCol + dirCol * i
+                if not (0 <= endRow <= 7 and 0 <= endCol <= 7):
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == ally and endPiece[1] != 'K':
+                    if possiblePin is None:
+                        possiblePin = (endRow, endCol)
+                    else:
+                        break
+                elif endPiece[0] == enemy:
+                    kind = endPiece[1]
+                    # orthogonal rays are the first four directions, enemy pawns attack the king diagonally
+                    # from the side they advance towards
+                    if (j <= 3 and kind == 'R') or (j >= 4 and kind == 'B') or kind == 'Q' or \
+                            (i == 1 and kind == 'K') or \
+                            (i == 1 and kind == 'p' and ((enemy == 'w' and j >= 6) or (enemy == 'b' and 4 <= j <= 5))):
+                        if possiblePin is None:
+                            checks.append((endRow, endCol, dirRow, dirCol))
+                        else:
+                            pins[possiblePin] = (dirRow, dirCol)
+                    break
+
+        for dirRow, dirCol in self.knightJumps:
+            endRow = startRow + dirRow
+            endCol = startCol + dirCol
+            if 0 <= endRow <= 7 and 0 <= endCol <= 7 and self.board[endRow][endCol] == enemy + 'N':
+                checks.append((endRow, endCol, dirRow, dirCol))
+
+        return len(checks) > 0, pins, checks
+
+    """
+    Whether the king of the side to move would be attacked standing on (r, c)
+    """
+    def kingSquareAttacked(self, r, c):
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingPosition
+        else:
+            kingRow, kingCol = self.blackKingPosition
+        king = self.board[kingRow][kingCol]
+        # lift the king so that it does not shadow a slider attacking along its own line
+        self.board[kingRow][kingCol] = '--'
+        attacked = self.squareUnderAttack((r, c), 'b' if self.whiteToMove else 'w')
+        self.board[kingRow][kingCol] = king
+        return attacked
+
+    def isEnpassantLegal(self, move):
+        capturedRow, capturedCol = move.startRow, move.endCol
+        self.board[move.startRow][move.startCol] = '--'
+        self.board[capturedRow][capturedCol] = '--'
+        self.board[move.endRow][move.endCol] = move.pieceMoved
+        if self.whiteToMove:
+            inCheck = self.squareUnderAttack(self.whiteKingPosition, 'b')
+        else:
+            inCheck = self.squareUnderAttack(self.blackKingPosition, 'w')
+        self.board[move.endRow][move.endCol] = '--'
+        self.board[capturedRow][capturedCol] = move.pieceCaptured
+        self.board[move.startRow][move.startCol] = move.pieceMoved
+        return not inCheck
+
+    def setKingPosition(self, color, position):
+        if color == 'w':
+            self.whiteKingPosition = position
+        else:
+            self.blackKingPosition = position
+
+    """
+    Walk outward from the square along slider rays and knight jumps and stop at the first piece of side attacking it
+    """
     def squareUnderAttack(self, square, side):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                color = self.board[r][c][0]
-                piece = self.board[r][c][1]
-                if side == color:
-                    self.moveFunctions[piece](r, c, moves)
+        r, c = square
+        board = self.board
+        for j, (dirRow, dirCol) in enumerate(self.directions):
+            endRow = r + dirRow
+            endCol = c + dirCol
+            i = 1
+            while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                endPiece = board[endRow][endCol]
+                if endPiece != '--':
+                    if endPiece[0] == side:
+                        kind = endPiece[1]
+                        if kind == 'Q' or (kind == 'R' if j <= 3 else kind == 'B'):
+                            return True
+                        if i == 1 and (kind == 'K' or
+                                       (kind == 'p' and ((side == 'w' and j >= 6) or (side == 'b' and 4 <= j <= 5)))):
+                            return True
+                    break
+                endRow += dirRow
+                endCol += dirCol
+                i += 1
 
-        for move in moves:
-            if square == move.end:
+        knight = side + 'N'
+        for dirRow, dirCol in self.knightJumps:
+            endRow = r + dirRow
+            endCol = c + dirCol
+            if 0 <= endRow <= 7 and 0 <= endCol <= 7 and board[endRow][endCol] == knight:
                 return True
 
         return False
 
     def checkCheck(self):
-        self.updateKingPosition()
         self.whiteKingInCheck = self.squareUnderAttack(self.whiteKingPosition, 'b')
         self.blackKingInCheck = self.squareUnderAttack(self.blackKingPosition, 'w')
 
@@ -164,71 +820,59 @@ class ChessBoard:
                     self.moveFunctions[piece](r, c, moves)
         return moves
 
+    """
+    Any move from or onto a king or rook home square gives up the castling rights tied to that square. Rights objects
+    are never changed in place, since undoMove restores the previous one by reference.
+    """
     def updateCastleRights(self, move):
-        if not self.castlingRightsLog[-1].wks:
-            self.currentCastlingRight.wks = False
-        if not self.castlingRightsLog[-1].wqs:
-            self.currentCastlingRight.wqs = False
-        if not self.castlingRightsLog[-1].bks:
-            self.currentCastlingRight.bks = False
-        if not self.castlingRightsLog[-1].bqs:
-            self.currentCastlingRight.bqs = False
-
-        if move.pieceMoved == 'wK':
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7:
-                    self.currentCastlingRight.bks = False
-
-        if move.pieceCaptured == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7:
-                    self.currentCastlingRight.bks = False
-
-    def getKingMoves(self, r, c, moves):
-        moves.extend([Move((r, c), (i, j), self.board)
-                      for i in range(8) for j in range(8)
-                      if (abs(r - i) <= 1) and (abs(c - j) <= 1) and
-                      self.board[i][j][0] != self.board[r][c][0]])
-
-        if c == 4:
-            if r == 0 and not self.blackKingInCheck:
-                if self.board[r][0] == 'bR' and self.board[r][1] == '--' and self.board[r][2] == '--' \
-                        and self.board[r][3] == '--' and self.currentCastlingRight.bqs and \
-                        not self.squareUnderAttack((r, 3), 'w'):
-                    moves.append(Move((r, c), (r, c - 2), self.board))
-                if self.board[r][7] == 'bR' and self.board[r][6] == '--' and self.board[r][5] == '--' \
-                        and self.currentCastlingRight.bks and not self.squareUnderAttack((r, 5), 'w'):
-                    moves.append(Move((r, c), (r, c + 2), self.board))
-            elif r == 7 and not self.whiteKingInCheck:
-                if self.board[r][0] == 'wR' and self.board[r][1] == '--' and self.board[r][2] == '--' \
-                        and self.board[r][3] == '--' and self.currentCastlingRight.wqs and \
-                        not self.squareUnderAttack((r, 3), 'b'):
-                    moves.append(Move((r, c), (r, c - 2), self.board))
-                if self.board[r][7] == 'wR' and self.board[r][6] == '--' and self.board[r][5] == '--' \
-                        and self.currentCastlingRight.wks and not self.squareUnderAttack((r, 5), 'b'):
-                    moves.append(Move((r, c), (r, c + 2), self.board))
+        rights = self.currentCastlingRight
+        wqs, wks, bqs, bks = rights.wqs, rights.wks, rights.bqs, rights.bks
+        for r, c in ((move.startRow, move.startCol), (move.endRow, move.endCol)):
+            if r == 7:
+                if c == 4:
+                    wqs = wks = False
+                elif c == 0:
+                    wqs = False
+                elif c == 7:
+                    wks = False
+            elif r == 0:
+                if c == 4:
+                    bqs = bks = False
+                elif c == 0:
+                    bqs = False
+                elif c == 7:
+                    bks = False
+        if (wqs, wks, bqs, bks) != (rights.wqs, rights.wks, rights.bqs, rights.bks):
+            self.currentCastlingRight = CastlingRights(wqs, wks, bqs, bks)
+
+    def getKingMoves(self, r, c, moves, legalOnly=False):
+        turn = self.board[r][c][0]
+        for dirRow, dirCol in self.directions:
+            endRow = r + dirRow
+            endCol = c + dirCol
+            if 0 <= endRow <= 7 and 0 <= endCol <= 7 and self.board[endRow][endCol][0] != turn:
+                if not legalOnly or not self.kingSquareAttacked(endRow, endCol):
+                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        return moves
+
+    """
+    Castling for the side to move; the king must not be in check and must not pass through an attacked square
+    """
+    def getCastleMoves(self, r, c, moves):
+        if c != 4 or r != (7 if self.whiteToMove else 0):
+            return moves
+        turn = self.board[r][c][0]
+        enemy = 'b' if turn == 'w' else 'w'
+        queenSide, kingSide = (self.currentCastlingRight.wqs, self.currentCastlingRight.wks) if turn == 'w' else \
+            (self.currentCastlingRight.bqs, self.currentCastlingRight.bks)
+        if queenSide and self.board[r][0] == turn + 'R' and self.board[r][1] == '--' and \
+                self.board[r][2] == '--' and self.board[r][3] == '--' and \
+                not self.squareUnderAttack((r, 3), enemy) and not self.squareUnderAttack((r, 2), enemy):
+            moves.append(Move((r, c), (r, c - 2), self.board))
+        if kingSide and self.board[r][7] == turn + 'R' and self.board[r][6] == '--' and \
+                self.board[r][5] == '--' and not self.squareUnderAttack((r, 5), enemy) and \
+                not self.squareUnderAttack((r, 6), enemy):
+            moves.append(Move((r, c), (r, c + 2), self.board))
         return moves
 
     def getQueenMoves(self, r, c, moves):
@@ -281,9 +925,12 @@ class ChessBoard:
         return moves
 
     def getKnightMoves(self, r, c, moves):
-        moves.extend([Move((r, c), (i, j), self.board) for i in range(8) for j in range(8)
-                      if ((abs(r - i) == 1 and abs(c - j) == 2) or (abs(r - i) == 2 and abs(c - j) == 1)) and
-                      self.board[i][j][0] != self.board[r][c][0]])
+        turn = self.board[r][c][0]
+        for dirRow, dirCol in self.knightJumps:
+            endRow = r + dirRow
+            endCol = c + dirCol
+            if 0 <= endRow <= 7 and 0 <= endCol <= 7 and self.board[endRow][endCol][0] != turn:
+                moves.append(Move((r, c), (endRow, endCol), self.board))
         return moves
 
     def getBishopMoves(self, r, c, moves):
@@ -347,7 +994,7 @@ class ChessBoard:
         if turn == "w":
             if self.board[r - 1][c] == '--':
                 moves.append(Move((r, c), (r - 1, c), self.board))
-            if r == 6 and self.board[r - 2][c] == '--':
+            if r == 6 and self.board[r - 1][c] == '--' and self.board[r - 2][c] == '--':
                 moves.append(Move((r, c), (r - 2, c), self.board))
             """
             capture to the right
@@ -368,7 +1015,7 @@ class ChessBoard:
         else:
             if self.board[r + 1][c] == '--':
                 moves.append(Move((r, c), (r + 1, c), self.board))
-            if r == 1 and self.board[r + 2][c] == '--':
+            if r == 1 and self.board[r + 1][c] == '--' and self.board[r + 2][c] == '--':
                 moves.append(Move((r, c), (r + 2, c), self.board))
             """
             capture to the right
@@ -406,29 +1053,55 @@ class CastlingRights:
 
 
 class Move:
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'isEnpassantMove', 'isCastling', 'moveID', 'encoded')
+
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
                    "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
+    promotionChoice = ('Q', 'R', 'N', 'B')
+
+    # flag bits above the two 6-bit square numbers (row * 8 + col) of the packed encoding
+    ENPASSANT = 1
+    CASTLING = 2
+    PROMOTION = 4
 
     def __init__(self, startSq, endSq, board, isEnpassantMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or \
-                               (self.pieceMoved == 'bp' and self.endRow == 7)
+        self.startRow = startRow = startSq[0]
+        self.startCol = startCol = startSq[1]
+        self.endRow = endRow = endSq[0]
+        self.endCol = endCol = endSq[1]
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
+        if isEnpassantMove:
+            self.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
+            flags = 1
+        else:
+            self.pieceCaptured = board[endRow][endCol]
+            flags = 0
+        if pieceMoved[1] == 'p':
+            self.isPawnPromotion = endRow == (0 if pieceMoved[0] == 'w' else 7)
+            self.isCastling = False
+            if self.isPawnPromotion:
+                flags |= 4
+        else:
+            self.isPawnPromotion = False
+            self.isCastling = pieceMoved[1] == 'K' and abs(endCol - startCol) == 2
+            if self.isCastling:
+                flags |= 2
+        self.moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+        self.encoded = (startRow * 8 + startCol) | (endRow * 8 + endCol) << 6 | flags << 12
 
-        self.isCastling = self.pieceMoved[1] == 'K' and abs(self.endCol - self.startCol) == 2
-        self.promotionChoice = ['Q', 'R', 'N', 'B']
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+    """
+    Rebuild a move from its packed encoding against the board it is to be played on
+    """
+    @classmethod
+    def fromEncoded(cls, encoded, board):
+        return cls(divmod(encoded & 63, 8), divmod(encoded >> 6 & 63, 8), board,
+                   isEnpassantMove=bool(encoded >> 12 & cls.ENPASSANT))
 
     """
     overriding the equals method
@@ -438,9 +1111,16 @@ class Move:
             return self.moveID == other.moveID
         return False  # if the other object is not even a "Move" it will always be False
 
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
         return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
 
+    # coordinate notation with the promotion piece, as UCI writes moves
+    def getUciNotation(self):
+        return self.getChessNotation() + ('q' if self.isPawnPromotion else '')
+
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
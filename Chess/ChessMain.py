@@ -1,11 +1,15 @@
+import argparse
+import threading
 import pygame
-from ChessEngine import ChessBoard, Move
+from ChessEngine import ChessBoard, Move, ONGOING, CHECKMATE
+from ChessWorker import EngineWorker, MOVES, SEARCH
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT / DIMENSION
 FPS = 20
 IMAGES = {}
+ENGINE_EVENT = pygame.USEREVENT + 1  # an answer from the engine worker, in event.response
 
 
 def loadImages():
@@ -14,28 +18,67 @@ def loadImages():
         IMAGES[piece] = pygame.transform.scale(pygame.image.load('Chess_images/' + piece + '.png'), (SQ_SIZE, SQ_SIZE))
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play chess in a pygame window')
+    parser.add_argument('--engine', choices=('white', 'black'), help='let the engine play this side')
+    parser.add_argument('-t', '--movetime', type=float, default=1.0, help='engine seconds per move')
+    parser.add_argument('-d', '--depth', type=int, help='engine depth limit in plies')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='bitboard',
+                        help='board backend of the engine worker')
+    parser.add_argument('--hash', type=int, default=16, metavar='MB', help='engine transposition table size')
+    args = parser.parse_args(argv)
+    engineWhite = args.engine == 'white'
+    searchLimits = {'movetime': args.movetime}
+    if args.depth is not None:
+        searchLimits['depth'] = args.depth
+
     # game initialization and screen creation
     pygame.init()
     screen = pygame.display.set_mode((HEIGHT, WIDTH))
     pygame.display.set_caption("Chess Game")
     clock = pygame.time.Clock()
     cb = ChessBoard()
-    validMoves = cb.getValidMoves()
+    # legal moves and engine replies are worked out in another process, so nothing here waits for them
+    worker = EngineWorker(args.backend, args.hash)
+    threading.Thread(target=forwardResponses, args=(worker,), daemon=True).start()
+    positionRequest = worker.request(cb, MOVES)
+    searchRequest = None
+    validMoves = []  # empty until the worker answers, and while the engine is to move
     moveMade = False
 
     loadImages()  # only do this once before while loop so as to avoid slowing down the script
+    view = BoardView(screen)
     sqSelected = ()  # keep track of the last click made by the player
     playerClicks = []  # keep track of player clicks - for making moves
+    highlights = set()  # squares the selected piece can move to
 
     running = True
     # creation of game loop
     while running:
-        clock.tick(FPS)
-        # process input
-        for event in pygame.event.get():
+        # sleep until something happens instead of polling, so an idle board costs no CPU
+        for event in [pygame.event.wait()] + pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                view.invalidate()
+            elif event.type == ENGINE_EVENT:
+                requestId, kind, payload = event.response
+                if kind == MOVES and requestId == positionRequest:
+                    encodedMoves, status = payload
+                    if status == CHECKMATE:
+                        print('black won!' if cb.whiteToMove else 'white won!')
+                    elif status != ONGOING:
+                        print(status + '!')
+                    if args.engine is not None and cb.whiteToMove == engineWhite:
+                        if status == ONGOING:
+                            searchRequest = worker.request(cb, SEARCH, **searchLimits)
+                    else:
+                        validMoves = [Move.fromEncoded(encoded, cb.board) for encoded in encodedMoves]
+                        highlights = getHighlights(validMoves, sqSelected)
+                elif kind == SEARCH and requestId == searchRequest and payload[0] is not None:
+                    cb.makeMove(Move.fromEncoded(payload[0], cb.board))
+                    moveMade = True
+                # anything else answers a request made before a move or an undo and no longer applies
             # mouse handler
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 location = pygame.mouse.get_pos()  # (x, y) location of mouse
@@ -59,70 +102,110 @@ def main():
 
                     sqSelected = ()
                     playerClicks = []
+                highlights = getHighlights(validMoves, sqSelected)
             # key handler
             elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_z:
+                if event.key == pygame.K_z and cb.moveLog:
+                    worker.cancel()  # whatever the engine is working on is for the position being taken back
                     cb.undoMove()
+                    if args.engine is not None and cb.whiteToMove == engineWhite:
+                        cb.undoMove()  # take back the engine's reply too, so it is the player's turn again
                     moveMade = True
 
         if moveMade:
             # print(cb.currentCastlingRight.wks, cb.currentCastlingRight.wqs)
-            validMoves = cb.getValidMoves()
+            positionRequest = worker.request(cb, MOVES)
+            searchRequest = None
+            validMoves = []
+            highlights = set()
             moveMade = False
 
-        # render
-        drawGameState(screen, cb, sqSelected)
-        pygame.display.update()
+        # render only the squares that changed, and push only those to the display
+        dirty = view.draw(cb, sqSelected, highlights)
+        if dirty:
+            pygame.display.update(dirty)
+        clock.tick(FPS)
 
+    worker.close()
     pygame.quit()
-
-
-def drawGameState(screen, gs, sqSelected):
-    drawBoard(screen)
-    drawPieces(screen, gs, gs.board, sqSelected)
-
-
-def drawBoard(screen):
+    return 0
+
+
+def forwardResponses(worker):
+    # runs on its own thread: wake the event loop with every answer from the worker
+    while True:
+        response = worker.get()
+        if response is None:
+            return
+        pygame.event.post(pygame.event.Event(ENGINE_EVENT, response=response))
+
+
+"""
+The squares the piece on sqSelected can move to, taken from the position's legal moves, so castling and en passant
+targets show and moves into check do not. Empty unless a piece of the side to move is selected.
+"""
+def getHighlights(validMoves, sqSelected):
+    if sqSelected == ():
+        return set()
+    return {(move.endRow, move.endCol) for move in validMoves if (move.startRow, move.startCol) == sqSelected}
+
+
+class BoardView:
+    """
+    The board on screen, drawn square by square over a pre-rendered surface of the empty board. It remembers what
+    each square shows, the piece and its outlines, so a frame redraws only the squares that changed and returns
+    their rectangles for pygame.display.update.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = drawBoard(pygame.Surface(screen.get_size()))
+        self.shown = [None] * (DIMENSION * DIMENSION)
+
+    def invalidate(self):
+        # the window lost its contents; draw every square on the next frame
+        self.shown = [None] * (DIMENSION * DIMENSION)
+
+    def draw(self, gs, sqSelected, highlights):
+        checked = ()
+        if gs.whiteKingInCheck:
+            checked = gs.whiteKingPosition
+        elif gs.blackKingInCheck:
+            checked = gs.blackKingPosition
+        dirty = []
+        for r in range(DIMENSION):
+            row = gs.board[r]
+            for c in range(DIMENSION):
+                piece = row[c]
+                state = (piece, sqSelected == (r, c) and piece != '--', (r, c) in highlights, checked == (r, c))
+                if state != self.shown[r * DIMENSION + c]:
+                    self.shown[r * DIMENSION + c] = state
+                    dirty.append(self.drawSquare(r, c, state))
+        return dirty
+
+    def drawSquare(self, r, c, state):
+        piece, selected, target, checked = state
+        rect = pygame.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        if piece != '--':
+            self.screen.blit(IMAGES[piece], rect)
+        if selected:
+            pygame.draw.rect(self.screen, pygame.Color('yellow'), rect, 3)
+        if target:
+            pygame.draw.rect(self.screen, pygame.Color('blue'), rect, 3)
+        if checked:
+            pygame.draw.rect(self.screen, pygame.Color('red'), rect, 5)
+        return rect
+
+
+def drawBoard(surface):
     # draw squares on the board
     colors = [pygame.Color('white'), pygame.Color('gray')]
     for r in range(DIMENSION):
         for c in range(DIMENSION):
-            pygame.draw.rect(screen, colors[(r + c) % 2], pygame.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def drawPieces(screen, gs, board, sqSelected):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != '--':
-                screen.blit(IMAGES[piece], pygame.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-    if sqSelected != () and board[sqSelected[0]][sqSelected[1]] != '--':
-        pygame.draw.rect(screen, (pygame.Color('yellow')),
-                         pygame.Rect(sqSelected[1] * SQ_SIZE, sqSelected[0] * SQ_SIZE, SQ_SIZE, SQ_SIZE), 3)
-
-        side = board[sqSelected[0]][sqSelected[1]][0]
-        piece = board[sqSelected[0]][sqSelected[1]][1]
-        moves = []
-        turn = 'w' if gs.whiteToMove else 'b'
-        if side == turn:
-            moves = gs.moveFunctions[piece](sqSelected[0], sqSelected[1], moves)
-
-        for move in moves:
-            destRow, destCol = move.end
-            pygame.draw.rect(screen, (pygame.Color('blue')),
-                             pygame.Rect(destCol * SQ_SIZE, destRow * SQ_SIZE, SQ_SIZE, SQ_SIZE), 3)
-
-    if gs.blackKingInCheck:
-        pygame.draw.rect(screen, (pygame.Color('red')),
-                         pygame.Rect(gs.blackKingPosition[1] * SQ_SIZE, gs.blackKingPosition[0] * SQ_SIZE,
-                                     SQ_SIZE, SQ_SIZE), 5)
-
-    if gs.whiteKingInCheck:
-        pygame.draw.rect(screen, (pygame.Color('red')),
-                         pygame.Rect(gs.whiteKingPosition[1] * SQ_SIZE, gs.whiteKingPosition[0] * SQ_SIZE,
-                                     SQ_SIZE, SQ_SIZE), 5)
+            pygame.draw.rect(surface, colors[(r + c) % 2], pygame.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return surface
 
 
 if __name__ == '__main__':
-    main()
+    raise SystemExit(main())
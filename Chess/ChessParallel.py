@@ -0,0 +1,268 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from ChessEngine import ChessBoard, Move, captureOrder
+from ChessSearch import Searcher, SearchAborted, SearchResult, printInfo, INFINITY, MATE, MATE_BOUND, MAX_PLY
+
+"""
+Root-splitting parallel search over a process pool. Each iteration searches the previous best root move first on
+one worker to get a bound, then tests every other root move against that bound with a null window in parallel and
+re-searches the ones that beat it with an open window. Workers keep their own Searcher and transposition table
+between tasks, so deeper iterations reuse what the shallower ones found. Positions go to the workers as the 38-byte
+ChessBoard snapshot plus the packed Move.encoded int of the root move, never as pickled ChessBoard objects.
+"""
+
+_worker = {}
+
+
+def _initWorker(backend, hashMB, stopEvent, nodesSpent):
+    searcher = Searcher(hashMB=hashMB, info=None)
+    # answer stop() from the parent between deadline checks
+    checkLimits = searcher.checkLimits
+
+    def checkLimitsOrStopped():
+        # checks come every 64 nodes; the node budget is shared by every worker, so charge them to the common count
+        # first, before any other limit can end the search
+        if _worker['nodeLimit'] is not None:
+            with nodesSpent.get_lock():
+                nodesSpent.value += 64
+                spent = nodesSpent.value
+            if spent >= _worker['nodeLimit']:
+                raise SearchAborted()
+        if stopEvent.is_set():
+            raise SearchAborted()
+        checkLimits()
+
+    searcher.checkLimits = checkLimitsOrStopped
+    _worker.update(backend=backend, searcher=searcher, snapshot=None, board=None, searchId=None, nodeLimit=None,
+                   nodesSpent=nodesSpent)
+
+
+def _searchRootMove(task):
+    searchId, snapshot, encoded, depth, alpha, beta, deadline, nodeLimit = task
+    searcher = _worker['searcher']
+    if _worker['snapshot'] != snapshot:
+        _worker['board'] = ChessBoard.fromSnapshot(snapshot, _worker['backend'])
+        _worker['snapshot'] = snapshot
+    cb = _worker['board']
+    if _worker['searchId'] != searchId:
+        searcher.startSearch()
+        _worker['searchId'] = searchId
+
+    # deadlines cross process boundaries as wall-clock time
+    searcher.deadline = time.perf_counter() + (deadline - time.time()) if deadline is not None else None
+    searcher.nodeLimit = None
+    _worker['nodeLimit'] = nodeLimit
+    searcher.nodes = 0
+    if nodeLimit is not None and _worker['nodesSpent'].value >= nodeLimit:
+        return encoded, None, [], 0
+    move = Move.fromEncoded(encoded, cb.board)
+    rootLength = len(cb.moveLog)
+    cb.makeMove(move)
+    try:
+        score = -searcher.negamax(cb, depth - 1, -beta, -alpha, 1)
+    except SearchAborted:
+        return encoded, None, [], searcher.nodes
+    finally:
+        while len(cb.moveLog) > rootLength:
+            cb.undoMove()
+        if nodeLimit is not None:
+            # the nodes since the last check, so the common count ends up exact
+            with _worker['nodesSpent'].get_lock():
+                _worker['nodesSpent'].value += searcher.nodes & 63
+    pv = [encoded] + [m.encoded for m in searcher.pvTable[1]]
+    return encoded, score, pv, searcher.nodes
+
+
+class ParallelSearcher:
+    """
+    Same search() interface and SearchResult as Searcher, spread over a pool of worker processes
+    """
+
+    def __init__(self, workers=None, backend='bitboard', hashMB=16, info=printInfo):
+        self.workers = workers or os.cpu_count() or 1
+        self.info = info
+        self.stopEvent = multiprocessing.Event()
+        self.nodesSpent = multiprocessing.Value('q', 0)  # nodes of the current search, counted by the workers
+        self.pool = multiprocessing.Pool(self.workers, initializer=_initWorker,
+                                         initargs=(backend, hashMB, self.stopEvent, self.nodesSpent))
+        self.searchId = 0
+        self.local = Searcher(hashMB=1, info=None)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def stop(self):
+        self.local.stop()
+        self.stopEvent.set()
+
+    def clearStop(self):
+        self.local.clearStop()
+        self.stopEvent.clear()
+
+    def search(self, cb, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None):
+        start = time.perf_counter()
+        deadline = time.time() + timeLimit if timeLimit is not None else None
+        self.searchId += 1
+        self.nodes = 0
+        stream = sys.stdout
+        snapshot = cb.toSnapshot()
+        result = SearchResult()
+
+        rootMoves = cb.getValidMoves([])
+        if len(rootMoves) == 0:
+            result.score = -MATE if cb.inCheck else 0
+            return result
+        byEncoding = {move.encoded: move for move in rootMoves}
+
+        # one ply is too cheap to farm out; searching it here gives the first split a sensible bound and order
+        result = self.local.search(cb, 1, timeLimit, nodeLimit)
+        self.nodes = result.nodes
+        self.nodesSpent.value = self.nodes
+        if self.info is not None:
+            self.info({'result': result, 'hashfull': 0}, stream)
+        rootMoves.sort(key=captureOrder, reverse=True)
+        order = [result.bestMove.encoded] + [move.encoded for move in rootMoves if move != result.bestMove]
+
+        for depth in range(2, min(maxDepth, MAX_PLY) + 1):
+            if len(rootMoves) == 1 or abs(result.score) >= MATE_BOUND:
+                break
+            if timeLimit is not None and time.perf_counter() - start > timeLimit / 2:
+                break
+            if nodeLimit is not None and self.nodes >= nodeLimit:
+                break
+
+            # every task gets the whole limit; the workers stop together once their common count reaches it
+            def tasks(moves, alpha, beta, depth=depth):
+                return [(self.searchId, snapshot, encoded, depth, alpha, beta, deadline, nodeLimit)
+                        for encoded in moves]
+
+            first = self.pool.apply(_searchRootMove, tasks(order[:1], -INFINITY, INFINITY))
+            self.nodes += first[3]
+            if first[1] is None:
+                break
+            best = first
+            scores = {first[0]: first[1]}
+
+            # everything else only has to prove it is no better than the first move
+            failHigh = []
+            aborted = False
+            for encoded, score, pv, nodes in self.pool.imap_unordered(
+                    _searchRootMove, tasks(order[1:], best[1], best[1] + 1)):
+                self.nodes += nodes
+                if score is None:
+                    aborted = True
+                elif score > best[1]:
+                    failHigh.append(encoded)
+                else:
+                    scores[encoded] = score
+            for outcome in self.pool.imap_unordered(_searchRootMove, tasks(failHigh, best[1], INFINITY)):
+                self.nodes += outcome[3]
+                if outcome[1] is None:
+                    aborted = True
+                elif outcome[1] > best[1]:
+                    best = outcome
+                scores[outcome[0]] = outcome[1] if outcome[1] is not None else best[1]
+
+            if aborted or self.stopEvent.is_set():
+                # a move that beat the previous best at the new depth is still the better choice
+                if best[0] != order[0]:
+                    result.bestMove = byEncoding[best[0]]
+                    result.score = best[1]
+                    result.pv = self.resolvePv(cb, best[2])
+                break
+
+            order.sort(key=lambda encoded: scores.get(encoded, -INFINITY), reverse=True)
+            order.remove(best[0])
+            order.insert(0, best[0])
+            result = SearchResult(byEncoding[best[0]], best[1], self.resolvePv(cb, best[2]), depth, self.nodes,
+                                  time.perf_counter() - start)
+            if self.info is not None:
+                self.info({'result': result, 'hashfull': 0}, stream)
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    def resolvePv(cb, encodedPv):
+        # turn the worker's packed principal variation back into Move objects on a scratch copy of the position
+        board = ChessBoard.fromSnapshot(cb.toSnapshot())
+        pv = []
+        for encoded in encodedPv:
+            move = Move.fromEncoded(encoded, board.board)
+            if move not in board.getValidMoves():
+                break
+            pv.append(move)
+            board.makeMove(move)
+        return pv
+
+
+BENCH_POSITIONS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+]
+
+
+"""
+Search every benchmark position to a fixed depth single-process and with the pool, and report the speedup
+"""
+def benchmark(depth, workers, backend='bitboard', hashMB=16):
+    totals = [0.0, 0.0]
+    print('%-8s %10s %10s %8s %8s  %s' % ('position', 'single', 'parallel', 'speedup', 'same', 'fen'))
+    with ParallelSearcher(workers, backend, hashMB, info=None) as parallel:
+        for i, fen in enumerate(BENCH_POSITIONS):
+            single = Searcher(hashMB=hashMB, info=None).search(ChessBoard(backend, fen), depth)
+            split = parallel.search(ChessBoard(backend, fen), depth)
+            totals[0] += single.elapsed
+            totals[1] += split.elapsed
+            print('%-8d %9.2fs %9.2fs %7.2fx %8s  %s' % (
+                i + 1, single.elapsed, split.elapsed, single.elapsed / split.elapsed if split.elapsed else 0,
+                'yes' if single.score == split.score else 'no', fen))
+    print('total    %9.2fs %9.2fs %7.2fx  (%d workers, depth %d)' % (
+        totals[0], totals[1], totals[0] / totals[1] if totals[1] else 0, workers, depth))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parallel root-splitting search over a process pool')
+    parser.add_argument('--fen', help='position to search (defaults to the starting position)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('-d', '--depth', type=int, default=MAX_PLY, help='maximum depth in plies')
+    parser.add_argument('-t', '--movetime', type=float, help='time budget in seconds')
+    parser.add_argument('-n', '--nodes', type=int, help='node budget')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='bitboard')
+    parser.add_argument('--hash', type=int, default=16, metavar='MB', help='transposition table size per worker')
+    parser.add_argument('--bench', action='store_true',
+                        help='compare against the single-process search on the benchmark positions')
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        benchmark(args.depth if args.depth != MAX_PLY else 4, args.workers, args.backend, args.hash)
+        return 0
+
+    cb = ChessBoard(args.backend, args.fen)
+    if args.movetime is None and args.nodes is None and args.depth == MAX_PLY:
+        args.movetime = 5.0
+    with ParallelSearcher(args.workers, args.backend, args.hash) as searcher:
+        result = searcher.search(cb, args.depth, args.movetime, args.nodes)
+    if result.bestMove is None:
+        print('no legal moves')
+        return 1
+    print('bestmove %s (%d nodes in %.2fs, %d nodes/sec)' % (result.bestMove.getChessNotation(), result.nodes,
+                                                             result.elapsed, result.nps))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
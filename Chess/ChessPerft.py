@@ -0,0 +1,228 @@
+import argparse
+import time
+from ChessEngine import ChessBoard
+from ChessEvaluation import scoreBoard
+from ChessTransposition import TranspositionTable
+
+"""
+Standard perft positions. Expected node counts are the published reference numbers and are only listed for depths
+where they apply to this engine (it always promotes to a queen, so depths that reach an under-promotion are left as
+benchmark-only).
+"""
+POSITIONS = {
+    'startpos': {
+        'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        'expected': {1: 20, 2: 400, 3: 8902, 4: 197281},
+        'depth': 3,
+    },
+    'kiwipete': {
+        'fen': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        'expected': {1: 48, 2: 2039, 3: 97862},
+        'depth': 2,
+    },
+    'enpassant': {
+        'fen': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        'expected': {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624},
+        'depth': 4,
+    },
+    'castling': {
+        'fen': 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1',
+        'expected': {1: 26, 2: 568, 3: 13744},
+        'depth': 3,
+    },
+    'castling-through-check': {
+        'fen': 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        'expected': {1: 6},
+        'depth': 2,
+    },
+}
+
+
+class PerftAborted(Exception):
+    pass
+
+
+def _perft(cb, depth, buffers, table=None, stop=None):
+    if depth == 1:
+        return cb.countValidMoves()
+    if stop is not None and stop.is_set():
+        raise PerftAborted()
+    if table is not None:
+        entry = table.probe(cb.zobristKey)
+        if entry is not None and entry[0] == depth:
+            return entry[1]
+    moves = cb.getValidMoves(buffers[depth])
+
+    nodes = 0
+    for move in moves:
+        cb.makeMove(move)
+        nodes += _perft(cb, depth - 1, buffers, table, stop)
+        cb.undoMove()
+    if table is not None:
+        table.store(cb.zobristKey, depth, nodes)
+    return nodes
+
+
+"""
+Count the leaf nodes of the legal move tree to the given depth. With a TranspositionTable, subtrees already counted
+from the same position are looked up instead of expanded again.
+"""
+def perft(cb, depth, table=None):
+    if depth == 0:
+        return 1
+    return _perft(cb, depth, [[] for _ in range(depth + 1)], table)
+
+
+"""
+Node count below each root move, keyed by its coordinate notation. Setting the stop event from another thread raises
+PerftAborted with the board back at the root.
+"""
+def divide(cb, depth, table=None, stop=None):
+    results = {}
+    if depth == 0:
+        return results
+    buffers = [[] for _ in range(depth)]
+    rootLength = len(cb.moveLog)
+    try:
+        for move in cb.getValidMoves():
+            cb.makeMove(move)
+            results[move.getChessNotation()] = _perft(cb, depth - 1, buffers, table, stop) if depth > 1 else 1
+            cb.undoMove()
+    except PerftAborted:
+        while len(cb.moveLog) > rootLength:
+            cb.undoMove()
+        raise
+    return results
+
+
+def _incrementalState(cb):
+    return cb.toSnapshot(), cb.zobristKey, cb.mgScore, cb.egScore, cb.phase, cb.pieceCount, dict(cb.positionCounts), \
+        len(cb.moveLog)
+
+
+def _verify(cb, depth, path):
+    if cb.zobristKey != cb.computeZobristKey():
+        raise AssertionError('Zobrist key differs from a rescan after %s' % ' '.join(path))
+    if (cb.mgScore, cb.egScore, cb.phase) != scoreBoard(cb.board):
+        raise AssertionError('scores %r differ from a rescan %r after %s' % (
+            (cb.mgScore, cb.egScore, cb.phase), scoreBoard(cb.board), ' '.join(path)))
+    if cb.pieceCount != 64 - sum([row.count('--') for row in cb.board]):
+        raise AssertionError('piece count %d differs from a rescan after %s' % (cb.pieceCount, ' '.join(path)))
+    if depth == 0:
+        return 1
+    before = _incrementalState(cb)
+    nodes = 0
+    for move in cb.getValidMoves():
+        path.append(move.getUciNotation())
+        cb.makeMove(move)
+        nodes += _verify(cb, depth - 1, path)
+        cb.undoMove()
+        if _incrementalState(cb) != before:
+            raise AssertionError('undoMove did not restore the position after %s' % ' '.join(path))
+        path.pop()
+    return nodes
+
+
+"""
+Walk the legal move tree like perft, checking at every node that the incrementally kept Zobrist key, material and
+piece-square totals, phase and piece count equal a full rescan of the board, and that every undoMove restores the
+position, clocks and repetition counts it was made from. Returns the node count; the first mismatch raises
+AssertionError naming the moves that led to it.
+"""
+def verify(cb, depth):
+    return _verify(cb, depth, [])
+
+
+def runVerify(names, depth=None, backend='array', fen=None):
+    failures = 0
+    positions = [('fen', fen, depth or 3)] if fen else \
+        [(name, POSITIONS[name]['fen'], depth or POSITIONS[name]['depth']) for name in names]
+    print('%-24s %5s %12s %9s  %s' % ('position', 'depth', 'nodes', 'seconds', 'incremental state'))
+    for name, positionFen, d in positions:
+        start = time.perf_counter()
+        try:
+            nodes = verify(ChessBoard(backend, positionFen), d)
+        except AssertionError as e:
+            failures += 1
+            print('%-24s %5d %12s %9.3f  MISMATCH: %s' % (name, d, '-', time.perf_counter() - start, e))
+            continue
+        print('%-24s %5d %12d %9.3f  ok' % (name, d, nodes, time.perf_counter() - start))
+    return failures
+
+
+def runPerft(fen, depth, showDivide=False, backend='array', hashMB=0):
+    cb = ChessBoard(backend, fen)
+    table = TranspositionTable(hashMB) if hashMB else None
+    start = time.perf_counter()
+    if showDivide:
+        results = divide(cb, depth, table)
+        nodes = sum(results.values())
+    else:
+        results = {}
+        nodes = perft(cb, depth, table)
+    elapsed = time.perf_counter() - start
+
+    for notation in sorted(results):
+        print('%s: %d' % (notation, results[notation]))
+    if results:
+        print()
+    return nodes, elapsed
+
+
+def runSuite(names, depth=None, backend='array', hashMB=0):
+    failures = 0
+    print('%-24s %5s %12s %12s %9s %12s' % ('position', 'depth', 'nodes', 'expected', 'seconds', 'nodes/sec'))
+    for name in names:
+        position = POSITIONS[name]
+        d = depth if depth is not None else position['depth']
+        expected = position['expected'].get(d)
+        try:
+            nodes, elapsed = runPerft(position['fen'], d, backend=backend, hashMB=hashMB)
+        except Exception as e:  # a broken position should not hide the numbers for the rest of the suite
+            failures += 1
+            print('%-24s %5d %12s %12s  %s: %s' % (name, d, '-', expected if expected is not None else '-',
+                                                  type(e).__name__, e))
+            continue
+        if expected is not None and expected != nodes:
+            failures += 1
+        print('%-24s %5d %12d %12s %9.3f %12.0f%s' % (
+            name, d, nodes, expected if expected is not None else '-', elapsed, nodes / elapsed if elapsed else 0,
+            '  MISMATCH' if expected is not None and expected != nodes else ''))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Perft node counts and move generation throughput for ChessBoard')
+    parser.add_argument('-d', '--depth', type=int, help='search depth (defaults to a per-position benchmark depth)')
+    parser.add_argument('-p', '--position', action='append', choices=sorted(POSITIONS),
+                        help='named position to run, may be repeated (defaults to the whole suite)')
+    parser.add_argument('--fen', help='run a single custom position instead of the suite')
+    parser.add_argument('--divide', action='store_true', help='print the node count below every root move')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='array',
+                        help='ChessBoard representation to benchmark (bitboard is only about 2.3-2.6x faster, short '
+                             'of the 10x target; see ChessBitboard)')
+    parser.add_argument('--hash', type=int, default=0, metavar='MB',
+                        help='transposition table size for caching subtree counts (0 disables it)')
+    parser.add_argument('--verify', action='store_true',
+                        help='check the incremental key, scores and undo state against a rescan at every node')
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        return 1 if runVerify(args.position or list(POSITIONS), args.depth, args.backend, args.fen) else 0
+
+    if args.fen or args.divide:
+        if args.fen:
+            fen = args.fen
+        else:
+            fen = POSITIONS[(args.position or ['startpos'])[0]]['fen']
+        depth = args.depth if args.depth is not None else 1
+        nodes, elapsed = runPerft(fen, depth, args.divide, args.backend, args.hash)
+        print('nodes: %d' % nodes)
+        print('time: %.3fs (%.0f nodes/sec)' % (elapsed, nodes / elapsed if elapsed else 0))
+        return 0
+
+    return 1 if runSuite(args.position or list(POSITIONS), args.depth, args.backend, args.hash) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
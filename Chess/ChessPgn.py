@@ -0,0 +1,350 @@
+import argparse
+import collections
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import time
+from ChessEngine import ChessBoard, Move
+
+"""
+Streaming PGN reader. Games are read one at a time from a file, an mmap of it or any iterable of lines, so memory
+stays bounded by the longest game rather than by the size of the archive. Moves in SAN are resolved against
+ChessBoard's legal moves and each game is replayed with makeMove, producing one PositionRecord per position.
+"""
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_TOKEN = re.compile(r'\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{}();$]+')
+_SAN = re.compile(r'([PNBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+
+class PgnError(ValueError):
+    pass
+
+
+class PgnGame:
+    def __init__(self, index, headers, movetext):
+        self.index = index
+        self.headers = headers
+        self.movetext = movetext
+
+    @property
+    def result(self):
+        return self.headers.get('Result', '*')
+
+    @property
+    def fen(self):
+        return self.headers.get('FEN')
+
+    """
+    A board at the game's starting position; a FEN tag that ChessBoard rejects raises PgnError
+    """
+    def startingBoard(self, backend='array'):
+        try:
+            return ChessBoard(backend, self.fen)
+        except ValueError as e:
+            raise PgnError('bad FEN tag: %s' % e)
+
+    """
+    The mainline moves in SAN, without move numbers, comments, variations, NAGs or the result
+    """
+    def sanMoves(self):
+        moves = []
+        depth = 0
+        for token in _TOKEN.findall(self.movetext):
+            first = token[0]
+            if first == '(':
+                depth += 1
+            elif first == ')':
+                depth -= 1
+            elif depth == 0 and first not in '{;$' and not token[-1] == '.' and token not in RESULTS:
+                moves.append(token)
+        return moves
+
+
+class PositionRecord:
+    # one position of a replayed game and the move played from it; the last position of a game has no move
+    __slots__ = ('game', 'ply', 'snapshot', 'key', 'san', 'uci', 'result')
+
+    def __init__(self, game, ply, snapshot, key, san, uci, result):
+        self.game = game
+        self.ply = ply
+        self.snapshot = snapshot
+        self.key = key
+        self.san = san
+        self.uci = uci
+        self.result = result
+
+    def toDict(self):
+        return {'game': self.game, 'ply': self.ply, 'snapshot': self.snapshot.hex(), 'key': '%016x' % self.key,
+                'san': self.san, 'uci': self.uci, 'result': self.result}
+
+
+"""
+Games from a PGN file path (read line by line, or through mmap when useMmap is set) or from any iterable of lines
+"""
+def readGames(source, useMmap=False):
+    if not isinstance(source, (str, bytes, os.PathLike)):
+        yield from _splitGames(source)
+        return
+    with open(source, 'rb') as f:
+        if useMmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from _splitGames(iter(mm.readline, b''))
+        else:
+            yield from _splitGames(f)
+
+
+def _splitGames(lines):
+    index = 0
+    headers = {}
+    movetext = []
+    openComments = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.strip()
+        if not line or line[0] == '%':
+            continue
+        if line[0] == '[' and not openComments:
+            if movetext:
+                # a tag after movetext starts the next game
+                yield PgnGame(index, headers, ' '.join(movetext))
+                index += 1
+                headers = {}
+                movetext = []
+            match = _TAG.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        movetext.append(line)
+        openComments += line.count('{') - line.count('}')
+        if not openComments and line.rsplit(None, 1)[-1] in RESULTS:
+            # the result ends the game, which is all that separates games exported without tags
+            yield PgnGame(index, headers, ' '.join(movetext))
+            index += 1
+            headers = {}
+            movetext = []
+    if headers or movetext:
+        yield PgnGame(index, headers, ' '.join(movetext))
+
+
+"""
+The legal move written as san in the current position. Only queen promotions exist in ChessBoard, so an
+under-promotion raises PgnError like an illegal or ambiguous move does.
+"""
+def resolveSan(cb, san, moves=None):
+    if moves is None:
+        moves = cb.getValidMoves()
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        endCol = 6 if len(text) == 3 else 2
+        for move in moves:
+            if move.isCastling and move.endCol == endCol:
+                return move
+        raise PgnError('illegal move %r' % san)
+
+    match = _SAN.match(text)
+    if match is None:
+        raise PgnError('unreadable move %r' % san)
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    if promotion is not None and promotion != 'Q':
+        raise PgnError('under-promotion %r is not supported' % san)
+    kind = 'p' if piece is None or piece == 'P' else piece
+    endRow = Move.ranksToRows[target[1]]
+    endCol = Move.filesToCols[target[0]]
+    startCol = Move.filesToCols[fromFile] if fromFile is not None else None
+    startRow = Move.ranksToRows[fromRank] if fromRank is not None else None
+
+    found = None
+    for move in moves:
+        if move.endRow == endRow and move.endCol == endCol and move.pieceMoved[1] == kind and \
+                (startCol is None or move.startCol == startCol) and (startRow is None or move.startRow == startRow):
+            if found is not None:
+                raise PgnError('ambiguous move %r' % san)
+            found = move
+    if found is None:
+        raise PgnError('illegal move %r' % san)
+    return found
+
+
+"""
+SAN of a legal move in the current position; moves are the position's legal moves when the caller has them already
+"""
+def toSan(cb, move, moves=None):
+    if moves is None:
+        moves = cb.getValidMoves()
+    if move.isCastling:
+        san = 'O-O' if move.endCol == 6 else 'O-O-O'
+    else:
+        kind = move.pieceMoved[1]
+        target = move.getRankFile(move.endRow, move.endCol)
+        capture = 'x' if move.pieceCaptured != '--' else ''
+        if kind == 'p':
+            san = (Move.colsToFiles[move.startCol] + capture if capture else '') + target + \
+                ('=Q' if move.isPawnPromotion else '')
+        else:
+            rivals = [other for other in moves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow
+                      and other.endCol == move.endCol and other != move]
+            origin = ''
+            if rivals:
+                if all([other.startCol != move.startCol for other in rivals]):
+                    origin = Move.colsToFiles[move.startCol]
+                elif all([other.startRow != move.startRow for other in rivals]):
+                    origin = Move.rowsToRanks[move.startRow]
+                else:
+                    origin = move.getRankFile(move.startRow, move.startCol)
+            san = kind + origin + capture + target
+    cb.makeMove(move)
+    if cb.whiteKingInCheck or cb.blackKingInCheck:
+        san += '+' if cb.hasLegalMove() else '#'
+    cb.undoMove()
+    return san
+
+
+"""
+Write one game as PGN: the tag pairs in the given order, then the movetext wrapped at 80 columns
+"""
+def writeGame(stream, headers, sanMoves, result, startPly=0):
+    for name, value in headers.items():
+        stream.write('[%s "%s"]\n' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')))
+    stream.write('\n')
+    tokens = []
+    for ply, san in enumerate(sanMoves, startPly):
+        if ply % 2 == 0:
+            tokens.append('%d.' % (ply // 2 + 1))
+        elif ply == startPly:
+            tokens.append('%d...' % (ply // 2 + 1))
+        tokens.append(san)
+    tokens.append(result)
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            stream.write(line + '\n')
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    stream.write(line + '\n\n')
+
+
+"""
+Replay the game on a fresh board and yield a PositionRecord for every position, the final one included. A move that
+cannot be resolved raises PgnError after the records of the positions before it.
+"""
+def replayGame(game, backend='array'):
+    cb = game.startingBoard(backend)
+    result = game.result
+    moves = []
+    ply = 0
+    for san in game.sanMoves():
+        move = resolveSan(cb, san, cb.getValidMoves(moves))
+        yield PositionRecord(game.index, ply, cb.toSnapshot(), cb.zobristKey, san, move.getUciNotation(), result)
+        cb.makeMove(move)
+        ply += 1
+    yield PositionRecord(game.index, ply, cb.toSnapshot(), cb.zobristKey, '', '', result)
+
+
+_worker = {}
+
+
+def _initWorker(backend):
+    _worker['backend'] = backend
+
+
+def _replayBatch(batch):
+    records = []
+    errors = []
+    for index, headers, movetext in batch:
+        try:
+            records.extend(replayGame(PgnGame(index, headers, movetext), _worker['backend']))
+        except PgnError as e:
+            errors.append((index, str(e)))
+    return records, errors
+
+
+def _batches(games, size):
+    batch = []
+    for game in games:
+        batch.append((game.index, game.headers, game.movetext))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+"""
+PositionRecords of every game in the source, in game order. With workers > 1 games are replayed in batches on a
+process pool; at most a few batches per worker are in flight at once, so memory stays bounded however long the
+file is. Games with a move that cannot be resolved are cut short there and reported through onError(index, message).
+"""
+def streamPositions(source, workers=0, backend='array', useMmap=False, batchSize=64, limit=None, onError=None):
+    games = readGames(source, useMmap)
+    if limit is not None:
+        games = itertools.islice(games, limit)
+
+    if workers <= 1:
+        for game in games:
+            try:
+                yield from replayGame(game, backend)
+            except PgnError as e:
+                if onError is not None:
+                    onError(game.index, str(e))
+        return
+
+    with multiprocessing.Pool(workers, initializer=_initWorker, initargs=(backend,)) as pool:
+        pending = collections.deque()
+        for batch in _batches(games, batchSize):
+            pending.append(pool.apply_async(_replayBatch, (batch,)))
+            if len(pending) >= 4 * workers:
+                yield from _finishBatch(pending.popleft(), onError)
+        while pending:
+            yield from _finishBatch(pending.popleft(), onError)
+
+
+def _finishBatch(pendingResult, onError):
+    records, errors = pendingResult.get()
+    if onError is not None:
+        for index, message in errors:
+            onError(index, message)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream a PGN file through ChessBoard and replay every game')
+    parser.add_argument('pgn', help='PGN file to read')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='worker processes (0 replays in-process)')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='array')
+    parser.add_argument('--mmap', action='store_true', help='read the file through mmap')
+    parser.add_argument('--limit', type=int, help='stop after this many games')
+    parser.add_argument('--batch', type=int, default=64, help='games per worker task')
+    parser.add_argument('--jsonl', action='store_true', help='write every position record to stdout as JSON')
+    args = parser.parse_args(argv)
+
+    errors = []
+    games = 0
+    positions = 0
+    start = time.perf_counter()
+    for record in streamPositions(args.pgn, args.workers, args.backend, args.mmap, args.batch, args.limit,
+                                  onError=lambda index, message: errors.append((index, message))):
+        positions += 1
+        if record.uci == '':
+            games += 1
+        if args.jsonl:
+            sys.stdout.write(json.dumps(record.toDict()) + '\n')
+    elapsed = time.perf_counter() - start
+
+    for index, message in errors:
+        print('game %d: %s' % (index + 1, message), file=sys.stderr)
+    print('%d games, %d positions, %d errors in %.2fs (%d positions/sec)' % (
+        games, positions, len(errors), elapsed, positions / elapsed if elapsed else 0), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+import argparse
+import cProfile
+import functools
+import inspect
+import json
+import sys
+import time
+import weakref
+from ChessBitboard import BitboardChessBoard
+from ChessEngine import ChessBoard, Move
+from ChessPerft import perft
+from ChessSearch import Searcher
+
+"""
+Opt-in counters and timers on ChessBoard's hot paths. While nothing is instrumented the classes hold their own
+methods and pay nothing; enable() swaps in counting and timing wrappers, and disable() puts the originals back.
+Stats come out as a JSON-friendly snapshot, a text report, or folded stacks ("a;b;c microseconds" per line) that
+flamegraph.pl, inferno and speedscope read. The command line runs perft or a search under instrumentation or cProfile.
+
+    with Instrumented(cb) as stats:
+        Searcher().search(cb, 4)
+    print(stats.report())
+"""
+
+# counted, and timed unless they are generators, on both board classes
+COUNTED = ('getValidMoves', 'generateMoves', 'makeMove', 'undoMove', 'squareUnderAttack', 'checkCheck')
+# the legality and generation passes beneath getValidMoves and generateMoves
+PASSES = ('checkForPinsAndChecks', 'getLegality', 'isLegalMove', 'getStageMoves', 'getPseudoLegalMove',
+          'legalTargets')
+# per-piece generators and the piece their time is booked to; a queen's rook and bishop moves count as queen time
+PIECE_GENERATORS = {'getPawnMoves': 'p', 'getKnightMoves': 'N', 'getBishopMoves': 'B', 'getRookMoves': 'R',
+                    'getQueenMoves': 'Q', 'getKingMoves': 'K', 'getCastleMoves': 'castling'}
+BOARD_CLASSES = (ChessBoard, BitboardChessBoard)
+
+_active = None  # the EngineStats being collected
+_patched = []  # (class, name, original) of every wrapper in place
+_boards = weakref.WeakSet()  # boards whose moveFunctions hold wrappers
+
+
+class EngineStats:
+    """
+    Calls and nanoseconds per instrumented method, time per piece kind, and Move allocations. With stacks set the
+    self time of every instrumented call is also kept per call stack, for a flame graph.
+    """
+
+    def __init__(self, stacks=False):
+        self.calls = dict.fromkeys(COUNTED + PASSES + tuple(PIECE_GENERATORS), 0)
+        self.time = dict.fromkeys(COUNTED + PASSES + tuple(PIECE_GENERATORS), 0)
+        self.pieceCalls = dict.fromkeys(PIECE_GENERATORS.values(), 0)
+        self.pieceTime = dict.fromkeys(PIECE_GENERATORS.values(), 0)
+        self.movesAllocated = 0
+        self.running = set()  # instrumented methods under way, so super() calls and recursion count once
+        self.generating = False  # inside a per-piece generator
+        self.folded = {} if stacks else None
+        self.stack = []  # [name, nanoseconds spent in instrumented callees] per instrumented frame
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def enter(self, name):
+        self.stack.append([name, 0])
+
+    def leave(self, elapsed):
+        name, children = self.stack.pop()
+        path = ';'.join([frame[0] for frame in self.stack] + [name])
+        self.folded[path] = self.folded.get(path, 0) + elapsed - children
+        if self.stack:
+            self.stack[-1][1] += elapsed
+
+    """
+    A copy of the numbers so far: calls and seconds per method and per piece kind, Moves allocated, wall time
+    """
+    def snapshot(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        return {
+            'elapsed': elapsed,
+            'movesAllocated': self.movesAllocated,
+            'methods': {name: {'calls': calls, 'seconds': self.time[name] / 1e9}
+                        for name, calls in self.calls.items() if calls},
+            'pieces': {piece: {'calls': calls, 'seconds': self.pieceTime[piece] / 1e9}
+                       for piece, calls in self.pieceCalls.items() if calls},
+        }
+
+    def report(self):
+        snapshot = self.snapshot()
+        lines = ['%.3fs wall, %d Move objects allocated' % (snapshot['elapsed'], snapshot['movesAllocated']),
+                 '%-24s %12s %10s %10s' % ('method', 'calls', 'seconds', 'us/call')]
+        for name, entry in sorted(snapshot['methods'].items(), key=lambda item: -item[1]['seconds']):
+            if name in PIECE_GENERATORS:
+                continue
+            lines.append('%-24s %12d %10.3f %10.2f' % (name, entry['calls'], entry['seconds'],
+                                                       1e6 * entry['seconds'] / entry['calls']))
+        if snapshot['pieces']:
+            lines.append('%-24s %12s %10s %10s' % ('piece generator', 'calls', 'seconds', 'us/call'))
+            for piece, entry in sorted(snapshot['pieces'].items(), key=lambda item: -item[1]['seconds']):
+                lines.append('%-24s %12d %10.3f %10.2f' % (piece, entry['calls'], entry['seconds'],
+                                                           1e6 * entry['seconds'] / entry['calls']))
+        return '\n'.join(lines)
+
+    """
+    Write the folded stacks, one "caller;callee self-microseconds" line per stack; needs stacks=True
+    """
+    def dumpFolded(self, stream):
+        if self.folded is None:
+            raise ValueError('stacks were not recorded; instrument with stacks=True')
+        for path, nanoseconds in sorted(self.folded.items()):
+            if nanoseconds >= 1000:
+                stream.write('%s %d\n' % (path, nanoseconds // 1000))
+
+
+def _counted(name, function):
+    if inspect.isgeneratorfunction(function):
+        # the work happens as the caller iterates, so only the call is counted
+        @functools.wraps(function)
+        def instrumented(*args, **kwargs):
+            _active.calls[name] += 1
+            return function(*args, **kwargs)
+        return instrumented
+
+    @functools.wraps(function)
+    def instrumented(*args, **kwargs):
+        stats = _active
+        if name in stats.running:
+            return function(*args, **kwargs)
+        stats.running.add(name)
+        if stats.folded is not None:
+            stats.enter(name)
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            stats.running.discard(name)
+            stats.calls[name] += 1
+            stats.time[name] += elapsed
+            if stats.folded is not None:
+                stats.leave(elapsed)
+    return instrumented
+
+
+def _pieceGenerator(name, piece, function):
+    @functools.wraps(function)
+    def instrumented(*args, **kwargs):
+        stats = _active
+        if stats.generating:
+            return function(*args, **kwargs)
+        stats.generating = True
+        if stats.folded is not None:
+            stats.enter(name)
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            stats.generating = False
+            stats.calls[name] += 1
+            stats.time[name] += elapsed
+            stats.pieceCalls[piece] += 1
+            stats.pieceTime[piece] += elapsed
+            if stats.folded is not None:
+                stats.leave(elapsed)
+    return instrumented
+
+
+def _trackBoards(function):
+    # boards created while instrumented bind the wrapped generators, so they are rebound on disable()
+    @functools.wraps(function)
+    def instrumented(self, *args, **kwargs):
+        function(self, *args, **kwargs)
+        _boards.add(self)
+    return instrumented
+
+
+def _countMoves(function):
+    @functools.wraps(function)
+    def instrumented(*args, **kwargs):
+        _active.movesAllocated += 1
+        function(*args, **kwargs)
+    return instrumented
+
+
+def _patch(cls, name, wrapper):
+    original = cls.__dict__[name]
+    _patched.append((cls, name, original))
+    setattr(cls, name, wrapper)
+
+
+"""
+Start collecting into stats (a new EngineStats when None) and return it. boards made earlier are switched over to
+the instrumented generators; boards made from now on are switched by themselves.
+"""
+def enable(stats=None, boards=(), stacks=False):
+    global _active
+    if _active is not None:
+        raise RuntimeError('instrumentation is already enabled')
+    _active = stats if stats is not None else EngineStats(stacks)
+    for cls in BOARD_CLASSES:
+        for name in COUNTED + PASSES:
+            if name in cls.__dict__:
+                _patch(cls, name, _counted(name, cls.__dict__[name]))
+        for name, piece in PIECE_GENERATORS.items():
+            if name in cls.__dict__:
+                _patch(cls, name, _pieceGenerator(name, piece, cls.__dict__[name]))
+    _patch(ChessBoard, '__init__', _trackBoards(ChessBoard.__dict__['__init__']))
+    _patch(Move, '__init__', _countMoves(Move.__dict__['__init__']))
+    for board in boards:
+        board.bindMoveFunctions()
+        _boards.add(board)
+    return _active
+
+
+"""
+Put the original methods back and return the stats collected
+"""
+def disable():
+    global _active
+    while _patched:
+        cls, name, original = _patched.pop()
+        setattr(cls, name, original)
+    for board in list(_boards):
+        board.bindMoveFunctions()
+    _boards.clear()
+    stats, _active = _active, None
+    if stats is not None:
+        stats.elapsed = time.perf_counter() - stats.started
+    return stats
+
+
+def snapshot():
+    return _active.snapshot() if _active is not None else None
+
+
+class Instrumented:
+    """
+    Context manager around enable() and disable(); binds the EngineStats being collected
+    """
+
+    def __init__(self, *boards, stacks=False):
+        self.boards = boards
+        self.stats = EngineStats(stacks)
+
+    def __enter__(self):
+        return enable(self.stats, self.boards)
+
+    def __exit__(self, *excInfo):
+        disable()
+
+
+def runWorkload(cb, command, depth):
+    if command == 'perft':
+        return '%d nodes' % perft(cb, depth)
+    result = Searcher(hashMB=16, info=None).search(cb, depth)
+    return '%d nodes, best move %s' % (result.nodes, result.bestMove.getUciNotation() if result.bestMove else '-')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run perft or a search with hot-path counters and timers')
+    parser.add_argument('command', choices=('perft', 'search'))
+    parser.add_argument('--fen', help='position to start from (defaults to the starting position)')
+    parser.add_argument('-d', '--depth', type=int, default=3)
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='array')
+    parser.add_argument('--json', action='store_true', help='print the stats snapshot as JSON instead of a table')
+    parser.add_argument('--folded', metavar='FILE', help='also write folded stacks for a flame graph here')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='profile with cProfile instead and write pstats data here (for snakeviz, gprof2dot...)')
+    args = parser.parse_args(argv)
+
+    cb = ChessBoard(args.backend, args.fen)
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        outcome = profiler.runcall(runWorkload, cb, args.command, args.depth)
+        profiler.dump_stats(args.cprofile)
+        print('%s; cProfile data written to %s' % (outcome, args.cprofile))
+        return 0
+
+    with Instrumented(cb, stacks=args.folded is not None) as stats:
+        outcome = runWorkload(cb, args.command, args.depth)
+    print(outcome, file=sys.stderr)
+    if args.json:
+        print(json.dumps(stats.snapshot(), indent=2))
+    else:
+        print(stats.report())
+    if args.folded:
+        with open(args.folded, 'w') as f:
+            stats.dumpFolded(f)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
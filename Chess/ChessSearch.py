@@ -0,0 +1,352 @@
+import argparse
+import sys
+import time
+from ChessEngine import ChessBoard, captureOrder
+from ChessEvaluation import evaluate
+from ChessTablebase import Tablebase, WIN, LOSS, DRAW
+from ChessTransposition import TranspositionTable, EXACT, LOWER, UPPER
+
+MATE = 100000
+MATE_BOUND = MATE - 1000  # anything beyond this is a forced mate
+INFINITY = MATE + 1
+MAX_PLY = 64
+
+# move ordering bands: hash move, then captures and promotions, then killers, then quiet moves by history
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 27
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class SearchResult:
+    def __init__(self, bestMove=None, score=0, pv=(), depth=0, nodes=0, elapsed=0.0):
+        self.bestMove = bestMove
+        self.score = score
+        self.pv = list(pv)
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    @property
+    def mateIn(self):
+        # moves to mate, negative when being mated, None for a normal score
+        if abs(self.score) < MATE_BOUND:
+            return None
+        plies = MATE - abs(self.score)
+        return (plies + 1) // 2 if self.score > 0 else -((plies + 1) // 2)
+
+
+def printInfo(info, stream=None):
+    result = info['result']
+    score = 'mate %d' % result.mateIn if result.mateIn is not None else 'cp %d' % result.score
+    print('depth %d score %s nodes %d nps %d time %d hashfull %d pv %s' % (
+        result.depth, score, result.nodes, result.nps, result.elapsed * 1000, info['hashfull'],
+        ' '.join([move.getChessNotation() for move in result.pv])), file=stream or sys.stdout, flush=True)
+
+
+class Searcher:
+    """
+    Negamax alpha-beta with iterative deepening and quiescence on captures, on top of ChessBoard's legal move
+    generator. Moves are ordered hash move first, then captures by MVV-LVA, then killer moves, then quiet moves by
+    history score. The search stops at the node or time budget, or when stop() is called from another thread; the
+    board is then unwound to the root and the best move of the deepest finished iteration is returned.
+    """
+
+    def __init__(self, table=None, hashMB=16, info=printInfo, book=None, tablebase=None):
+        self.table = table if table is not None else TranspositionTable(hashMB)
+        self.info = info
+        self.book = book  # an OpeningBook consulted before searching
+        self.tablebase = tablebase  # a Tablebase whose endings are looked up instead of searched
+        self.stopped = False
+        self.nodes = 0
+        self.deadline = None
+        self.nodeLimit = None
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 2)]
+        self.history = [0] * 8192
+        self.pvTable = [[] for _ in range(MAX_PLY + 2)]
+
+    """
+    End the search under way from another thread. The flag stays set until clearStop(), so a stop that arrives
+    before the searching thread has started still ends that search at once.
+    """
+    def stop(self):
+        self.stopped = True
+
+    def clearStop(self):
+        self.stopped = False
+
+    """
+    Search the position for at most maxDepth plies, timeLimit seconds and nodeLimit nodes
+    """
+    def search(self, cb, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None):
+        start = time.perf_counter()
+        self.startSearch(timeLimit, nodeLimit)
+        stream = sys.stdout
+        rootLength = len(cb.moveLog)
+        result = SearchResult()
+
+        rootMoves = cb.getValidMoves([])
+        if len(rootMoves) == 0:
+            result.score = -MATE if cb.inCheck else 0
+            return result
+        if self.book is not None:
+            move = self.book.chooseMove(cb)
+            if move is not None:
+                return SearchResult(move, 0, [move], 0, 0, time.perf_counter() - start)
+        if self.tablebase is not None:
+            found = self.tablebase.probe(cb)
+            if found is not None:
+                # no deeper than asked for and no longer than the time allows; the score is exact either way
+                pv = self.tablebase.line(cb, min(maxDepth, found[1]) if found[0] != DRAW else 1, self.deadline)
+                if pv:
+                    result = SearchResult(pv[0], self.tablebaseScore(found, 0), pv, len(pv), 0,
+                                          time.perf_counter() - start)
+                    if self.info is not None:
+                        self.info({'result': result, 'hashfull': self.table.hashfull()}, stream)
+                    return result
+        result.bestMove = rootMoves[0]
+        result.pv = [rootMoves[0]]
+
+        for depth in range(1, min(maxDepth, MAX_PLY) + 1):
+            try:
+                score = self.searchRoot(cb, rootMoves, depth)
+            except SearchAborted:
+                while len(cb.moveLog) > rootLength:
+                    cb.undoMove()
+                # the previous best move is searched first, so whatever leads this unfinished iteration has
+                # either confirmed it or beaten it at the greater depth
+                if self.partialBest is not None:
+                    result.bestMove, result.score, result.pv = self.partialBest
+                break
+
+            result = SearchResult(self.pvTable[0][0], score, self.pvTable[0], depth, self.nodes,
+                                  time.perf_counter() - start)
+            if self.info is not None:
+                self.info({'result': result, 'hashfull': self.table.hashfull()}, stream)
+            if len(rootMoves) == 1 or abs(score) >= MATE_BOUND:
+                break
+            # the next iteration costs several times this one; don't start what cannot finish
+            if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    """
+    Reset the budget, counters and move ordering heuristics for a new search
+    """
+    def startSearch(self, timeLimit=None, nodeLimit=None):
+        self.nodes = 0
+        self.deadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 2)]
+        self.history = [0] * 8192
+        self.table.newSearch()
+
+    def checkLimits(self):
+        if self.stopped or (self.nodeLimit is not None and self.nodes >= self.nodeLimit) or \
+                (self.deadline is not None and time.perf_counter() >= self.deadline):
+            raise SearchAborted()
+
+    def searchRoot(self, cb, rootMoves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        self.partialBest = None
+        previousBest = self.pvTable[0][0] if self.pvTable[0] else None
+        rootMoves.sort(key=lambda move: self.orderScore(move, previousBest.encoded if previousBest else 0, 0),
+                       reverse=True)
+        for move in rootMoves:
+            cb.makeMove(move)
+            score = -self.negamax(cb, depth - 1, -beta, -alpha, 1)
+            cb.undoMove()
+            if score > alpha:
+                alpha = score
+                self.pvTable[0] = [move] + self.pvTable[1]
+                self.partialBest = (move, score, self.pvTable[0])
+        self.table.store(cb.zobristKey, depth, alpha, EXACT, self.pvTable[0][0].encoded)
+        return alpha
+
+    def negamax(self, cb, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 63 == 0:
+            self.checkLimits()
+        self.pvTable[ply] = []
+        if cb.halfmoveClock >= 100 or self.isRepetition(cb):
+            return 0
+        if ply >= MAX_PLY:
+            return evaluate(cb)
+        if self.tablebase is not None and cb.pieceCount <= self.tablebase.maxPieces:
+            found = self.tablebase.probe(cb)
+            if found is not None:
+                return self.tablebaseScore(found, ply)
+
+        inCheck = cb.whiteKingInCheck if cb.whiteToMove else cb.blackKingInCheck
+        if inCheck and depth > 0:
+            # extended before the table is probed, so entries are stored and looked up at the same depth
+            depth += 1  # check extension
+
+        alphaOrig = alpha
+        hashMove = 0
+        entry = self.table.probe(cb.zobristKey)
+        if entry is not None:
+            entryDepth, value, flag, hashMove = entry
+            if entryDepth >= depth:
+                value = self.fromTable(value, ply)
+                if flag == EXACT:
+                    return value
+                if flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        if depth <= 0:
+            return self.quiesce(cb, alpha, beta, ply)
+
+        killers = self.killers[ply]
+
+        best = -INFINITY
+        bestMove = None
+        # quiet moves are only generated, and sorted by killers and history, when no capture has cut off
+        for move in cb.generateMoves(hashMove, quietOrder=lambda move: self.quietScore(move, killers)):
+            cb.makeMove(move)
+            score = -self.negamax(cb, depth - 1, -beta, -alpha, ply + 1)
+            cb.undoMove()
+            if score > best:
+                best = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        if move.pieceCaptured == '--' and not move.isPawnPromotion:
+                            if killers[0] != move.encoded:
+                                killers[1] = killers[0]
+                                killers[0] = move.encoded
+                            self.history[self.historyIndex(move)] += depth * depth
+                        break
+
+        if bestMove is None:
+            return -MATE + ply if inCheck else 0
+        if best <= alphaOrig:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(cb.zobristKey, depth, self.toTable(best, ply), flag, bestMove.encoded)
+        return best
+
+    def quiesce(self, cb, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 63 == 0:
+            self.checkLimits()
+        standPat = evaluate(cb)
+        if standPat >= beta or ply >= MAX_PLY:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+
+        for move in cb.generateMoves(quiets=False):
+            cb.makeMove(move)
+            score = -self.quiesce(cb, -beta, -alpha, ply + 1)
+            cb.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def orderScore(self, move, hashMove, ply):
+        if move.encoded == hashMove:
+            return HASH_MOVE_SCORE
+        if move.pieceCaptured != '--' or move.isPawnPromotion:
+            return CAPTURE_SCORE + captureOrder(move)
+        return self.quietScore(move, self.killers[ply])
+
+    def quietScore(self, move, killers):
+        if move.encoded == killers[0]:
+            return KILLER_SCORE + 1
+        if move.encoded == killers[1]:
+            return KILLER_SCORE
+        return self.history[self.historyIndex(move)]
+
+    @staticmethod
+    def historyIndex(move):
+        return (move.encoded & 0xFFF) | (4096 if move.pieceMoved[0] == 'b' else 0)
+
+    @staticmethod
+    def tablebaseScore(found, ply):
+        result, plies = found
+        if result == WIN:
+            return MATE - ply - plies
+        if result == LOSS:
+            return -MATE + ply + plies
+        return 0
+
+    @staticmethod
+    def isRepetition(cb):
+        # inside the tree one earlier occurrence is enough to score the line as a draw
+        return cb.positionCounts[cb.zobristKey] > 1
+
+    # mate scores are stored relative to the node so they stay correct when reached along another path
+    @staticmethod
+    def toTable(score, ply):
+        if score >= MATE_BOUND:
+            return score + ply
+        if score <= -MATE_BOUND:
+            return score - ply
+        return score
+
+    @staticmethod
+    def fromTable(score, ply):
+        if score >= MATE_BOUND:
+            return score - ply
+        if score <= -MATE_BOUND:
+            return score + ply
+        return score
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search a position with ChessBoard and report the best move')
+    parser.add_argument('--fen', help='position to search (defaults to the starting position)')
+    parser.add_argument('-d', '--depth', type=int, default=MAX_PLY, help='maximum depth in plies')
+    parser.add_argument('-t', '--movetime', type=float, help='time budget in seconds')
+    parser.add_argument('-n', '--nodes', type=int, help='node budget')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='bitboard')
+    parser.add_argument('--hash', type=int, default=16, metavar='MB', help='transposition table size')
+    parser.add_argument('--book', help='Polyglot opening book to play from before searching')
+    parser.add_argument('--tablebase', help='endgame tablebase file (see ChessTablebase) to look endings up in')
+    args = parser.parse_args(argv)
+
+    cb = ChessBoard(args.backend, args.fen)
+    if args.movetime is None and args.nodes is None and args.depth == MAX_PLY:
+        args.movetime = 5.0
+    book = None
+    if args.book:
+        from ChessBook import OpeningBook
+        book = OpeningBook(args.book)
+    tablebase = Tablebase(args.tablebase) if args.tablebase else None
+    result = Searcher(hashMB=args.hash, book=book, tablebase=tablebase).search(cb, args.depth, args.movetime,
+                                                                             args.nodes)
+    if result.bestMove is None:
+        print('no legal moves')
+        return 1
+    if result.depth == 0:
+        print('bestmove %s (book)' % result.bestMove.getChessNotation())
+        return 0
+    print('bestmove %s (%d nodes in %.2fs, %d nodes/sec)' % (result.bestMove.getChessNotation(), result.nodes,
+                                                             result.elapsed, result.nps))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,546 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from ChessEngine import ChessBoard, CastlingRights
+
+try:
+    import numpy as np
+except ImportError:  # only solving needs NumPy; probing a finished file does not
+    np = None
+
+"""
+Endgame tablebases for a king and one or two pieces against a lone king: KQK, KRK, KPK and KBNK. Every position of
+an ending is given an index from the squares of its pieces, and the tables are solved by retrograde analysis over
+all indices at once with NumPy: mates first, then positions one ply further from mate on every pass, until a pass
+finds nothing new. What is left is drawn. Results are stored one byte per position in a single file that is read
+through mmap, so probing costs a few list scans and one byte read, and a search that reaches such an ending never
+has to look further. The stronger side may be either colour; positions are mirrored onto the stored ones.
+
+Moves follow ChessBoard's rules, promotions included: a pawn only ever promotes to a queen, so KPK is solved
+together with KQK. Castling and en passant cannot occur in these endings, and the fifty-move rule is not taken
+into account.
+"""
+
+WIN = 'win'
+DRAW = 'draw'
+LOSS = 'loss'
+
+# the stronger side's pieces besides its king, in the order their squares make up the index
+TABLES = {'KQK': ('Q',), 'KRK': ('R',), 'KPK': ('p',), 'KBNK': ('B', 'N')}
+DEPENDENCIES = {'KPK': ('KQK',)}  # endings a move can convert into
+PIECE_ORDER = 'QRBNp'
+
+"""
+File layout: a header (magic, version, table count), one directory entry per table (name, offset of its data, bytes
+per side to move), then the tables. A table is the white to move block followed by the black to move block, one
+byte per position indexed by the stronger king's square (one of its canonical squares, see canonicalSquares), then
+the squares of the other pieces in TABLES order and of the lone king, row * 8 + col as in ChessBoard. Byte 0 is a
+draw, 255 a position that cannot occur, and n a forced mate in n - 1 plies: won for white to move, lost for black.
+"""
+MAGIC = b'CHTB'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+DIRECTORY_ENTRY = struct.Struct('<8sQQ')
+DRAW_BYTE = 0
+ILLEGAL_BYTE = 255
+
+# values while solving: plies to mate, or one of these
+UNKNOWN = -1
+ILLEGAL = -2
+
+
+def _targets(square, steps, slide):
+    r, c = divmod(square, 8)
+    found = []
+    for dr, dc in steps:
+        row, col = r + dr, c + dc
+        while 0 <= row < 8 and 0 <= col < 8:
+            found.append(row * 8 + col)
+            if not slide:
+                break
+            row, col = row + dr, col + dc
+    return found
+
+
+def _between(start, end):
+    (r1, c1), (r2, c2) = divmod(start, 8), divmod(end, 8)
+    dr, dc = r2 - r1, c2 - c1
+    if start == end or (dr and dc and abs(dr) != abs(dc)):
+        return []
+    steps = max(abs(dr), abs(dc))
+    dr, dc = (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)
+    return [(r1 + dr * i) * 8 + c1 + dc * i for i in range(1, steps)]
+
+
+_STEPS = {'K': (ChessBoard.directions, False), 'N': (ChessBoard.knightJumps, False),
+          'Q': (ChessBoard.directions, True), 'R': (ChessBoard.slideDirections['R'], True),
+          'B': (ChessBoard.slideDirections['B'], True)}
+ATTACKS = {kind: [_targets(square, steps, slide) for square in range(64)] for kind, (steps, slide) in _STEPS.items()}
+# white pawns attack towards row 0, so a square is attacked from the two diagonally behind it
+ATTACKS['p'] = [_targets(square, ((1, -1), (1, 1)), False) if square < 48 else [] for square in range(64)]
+BETWEEN = [[_between(start, end) for end in range(64)] for start in range(64)]
+ADJACENT = [[max(abs(a // 8 - b // 8), abs(a % 8 - b % 8)) <= 1 for b in range(64)] for a in range(64)]
+
+
+"""
+(to, squares that must be empty) for every non-promoting move of a white piece of the kind from square, on an
+otherwise empty board
+"""
+def _whiteMoves(kind, square):
+    if kind != 'p':
+        return [(end, BETWEEN[square][end]) for end in ATTACKS[kind][square]]
+    row = square // 8
+    if not 2 <= row <= 6:
+        return []
+    moves = [(square - 8, [])]
+    if row == 6:
+        moves.append((square - 16, [square - 8]))
+    return moves
+
+
+WHITE_MOVES = {kind: [_whiteMoves(kind, square) for square in range(64)] for kind in ('K', 'Q', 'R', 'B', 'N', 'p')}
+
+# the stronger king is mirrored into the a1-d1-d4 triangle, or onto files a-d when there is a pawn
+PAWNLESS_SQUARES = [square for square in range(64) if square % 8 <= 3 and 7 - square // 8 <= square % 8]
+PAWN_SQUARES = [square for square in range(64) if square % 8 <= 3]
+
+
+def canonicalSquares(name):
+    return PAWN_SQUARES if 'p' in TABLES[name] else PAWNLESS_SQUARES
+
+
+def _axisVector(values, axis, dims):
+    shape = [1] * dims
+    shape[axis] = 64
+    return np.asarray(values).reshape(shape)
+
+
+def _onSquares(squares, axis, dims):
+    vector = np.zeros(64, dtype=bool)
+    vector[squares] = True
+    return _axisVector(vector, axis, dims)
+
+
+def _at(dims, axis, square):
+    index = [slice(None)] * dims
+    index[axis] = square
+    return tuple(index)
+
+
+"""
+Mask over the axes left after removing axis: True where none of the pieces on those axes stands on a blocker square
+"""
+def _clear(blockers, axis, axes, dims):
+    clear = True
+    for other in axes:
+        if other != axis:
+            clear = clear & ~_onSquares(blockers, other - (other > axis), dims - 1)
+    return clear
+
+
+"""
+Solve one ending. Returns the white to move and black to move arrays of plies to mate (UNKNOWN for a draw, ILLEGAL
+for a position that cannot occur), indexed by square in TABLES order with the lone king last. solved holds the
+arrays of endings this one converts into.
+"""
+def solveTable(name, solved, progress=None):
+    if np is None:
+        raise RuntimeError('solving tablebases needs NumPy')
+    pieces = TABLES[name]
+    dims = len(pieces) + 2
+    shape = (64,) * dims
+    loneKing = dims - 1
+    squares = [_axisVector(np.arange(64), axis, dims) for axis in range(dims)]
+    adjacent = np.array(ADJACENT)
+
+    legal = np.ones(shape, dtype=bool)
+    for i in range(dims):
+        for j in range(i + 1, dims):
+            legal &= squares[i] != squares[j]
+    legal &= ~adjacent[squares[0], squares[loneKing]]
+    for axis, kind in enumerate(pieces, 1):
+        if kind == 'p':
+            legal &= (squares[axis] >= 8) & (squares[axis] < 56)
+
+    # attacked[..., t]: the white pieces other than the king attack t, looking through the black king (ATTACKS
+    # lists the squares a piece attacks, which for everything but pawns are also the squares it is attacked from)
+    attacked = np.zeros(shape, dtype=bool)
+    for target in range(64):
+        view = attacked[..., target]
+        for axis, kind in enumerate(pieces, 1):
+            for source in ATTACKS[kind][target]:
+                view[_at(dims - 1, axis, source)] |= _clear(BETWEEN[source][target], axis, range(dims - 1),
+                                                            dims - 1)
+    # black king moves from f to t: illegal where t is guarded, a capture where a white piece stands on t
+    guarded = attacked | adjacent[squares[0], squares[loneKing]]
+    captures = np.zeros(shape, dtype=bool)
+    for axis in range(1, dims - 1):
+        captures |= squares[axis] == squares[loneKing]
+    captures &= ~guarded
+    hasMove = np.zeros(shape, dtype=bool)
+    escapes = np.zeros(shape, dtype=bool)
+    for source in range(64):
+        for target in ATTACKS['K'][source]:
+            hasMove[..., source] |= ~guarded[..., target]
+            escapes[..., source] |= captures[..., target]
+
+    white = np.where(legal & ~attacked, UNKNOWN, ILLEGAL).astype(np.int16)
+    black = np.where(legal, UNKNOWN, ILLEGAL).astype(np.int16)
+    black[legal & attacked & ~hasMove] = 0
+    # taking the last piece, or one of the two, always draws, so only positions without such a capture can be lost
+    mayLose = legal & hasMove & ~escapes
+    del legal, attacked, captures, escapes, hasMove
+
+    promotions = None
+    if 'p' in pieces:
+        promotions = solved['KQK'][1]
+    horizon = int(promotions.max()) + 1 if promotions is not None else 0
+
+    ply = 1
+    quiet = 0
+    while quiet < 2 or ply <= horizon:
+        if ply % 2:
+            found = _whiteStep(white, black, pieces, ply, promotions)
+        else:
+            found = _blackStep(white, black, guarded, mayLose, ply)
+        quiet = 0 if found else quiet + 1
+        if progress is not None:
+            progress(name, ply, found)
+        ply += 1
+    return white, black
+
+
+"""
+White to move positions won in ply plies: those with a move to a black to move position lost in ply - 1
+"""
+def _whiteStep(white, black, pieces, ply, promotions):
+    dims = white.ndim
+    frontier = black == ply - 1
+    found = 0
+    for axis, kind in enumerate(('K',) + pieces):
+        present = frontier.any(axis=tuple([other for other in range(dims) if other != axis]))
+        for source in range(64):
+            current = white[_at(dims, axis, source)]
+            for target, blockers in WHITE_MOVES[kind][source]:
+                if not present[target]:
+                    continue
+                reach = frontier[_at(dims, axis, target)]
+                if blockers:
+                    reach = reach & _clear(blockers, axis, range(dims), dims)
+                won = reach & (current == UNKNOWN)
+                found += int(np.count_nonzero(won))
+                current[won] = ply
+            if kind == 'p' and promotions is not None and 8 <= source < 16:
+                # the pawn queens: the position continues in KQK with the queen on the promotion square
+                won = (promotions[:, source - 8, :] == ply - 1) & (current == UNKNOWN)
+                found += int(np.count_nonzero(won))
+                current[won] = ply
+    return found
+
+
+"""
+Black to move positions lost in ply plies: those where every king move reaches a position white has won
+"""
+def _blackStep(white, black, guarded, mayLose, ply):
+    won = white > 0
+    found = 0
+    for source in range(64):
+        current = black[..., source]
+        lost = mayLose[..., source] & (current == UNKNOWN)
+        if not lost.any():
+            continue
+        for target in ATTACKS['K'][source]:
+            lost &= guarded[..., target] | won[..., target]
+        found += int(np.count_nonzero(lost))
+        current[lost] = ply
+    return found
+
+
+def _toBytes(values):
+    data = np.where(values == UNKNOWN, DRAW_BYTE, values + 1)
+    return np.where(values == ILLEGAL, ILLEGAL_BYTE, data).astype(np.uint8)
+
+
+"""
+Solve the named endings, and whatever they convert into, and write them to path. Returns the names written.
+"""
+def generateTablebase(path, names=tuple(TABLES), progress=None):
+    order = []
+    for name in names:
+        for needed in DEPENDENCIES.get(name, ()) + (name,):
+            if needed not in order:
+                order.append(needed)
+    solved = {}
+    for name in order:
+        solved[name] = solveTable(name, solved, progress)
+
+    blocks = []
+    offset = HEADER.size + DIRECTORY_ENTRY.size * len(order)
+    directory = []
+    for name in order:
+        kings = canonicalSquares(name)
+        white, black = [_toBytes(values[kings]).tobytes() for values in solved[name]]
+        directory.append(DIRECTORY_ENTRY.pack(name.encode('ascii'), offset, len(white)))
+        blocks += [white, black]
+        offset += 2 * len(white)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(order)))
+        for entry in directory:
+            f.write(entry)
+        for block in blocks:
+            f.write(block)
+    return order
+
+
+class Tablebase:
+    """
+    A tablebase file opened through mmap
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError('%s is empty' % path)
+        magic, version, count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a version %d tablebase file' % (path, VERSION))
+        self.tables = {}  # name -> (offset, bytes per side to move, index of every canonical king square)
+        for i in range(count):
+            name, offset, size = DIRECTORY_ENTRY.unpack_from(self.data, HEADER.size + i * DIRECTORY_ENTRY.size)
+            name = name.rstrip(b'\0').decode('ascii')
+            if offset + 2 * size > len(self.data):
+                self.close()
+                raise ValueError('%s is truncated' % path)
+            self.tables[name] = (offset, size, {square: index for index, square in enumerate(canonicalSquares(name))})
+        self.maxPieces = max([len(TABLES[name]) + 2 for name in self.tables] + [2])
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    """
+    (WIN, DRAW or LOSS for the side to move, plies to mate) for a position of one of the stored endings, or a bare
+    king against a king and at most one minor piece; None for anything else
+    """
+    def probe(self, cb):
+        if cb.phase > 4:
+            return None
+        if cb.pieceCount > self.maxPieces:
+            return None
+        board = cb.board
+        rights = cb.currentCastlingRight
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            return None
+
+        kings = {}
+        others = []
+        for r in range(8):
+            row = board[r]
+            for c in range(8):
+                piece = row[c]
+                if piece != '--':
+                    if piece[1] == 'K':
+                        kings[piece[0]] = r * 8 + c
+                    else:
+                        others.append((PIECE_ORDER.index(piece[1]), piece[0], r * 8 + c))
+        if not others or (len(others) == 1 and others[0][0] in (2, 3)):
+            return DRAW, 0
+        strong = others[0][1]
+        if any([color != strong for _, color, _ in others]):
+            return None
+        others.sort()
+        name = 'K' + ''.join([PIECE_ORDER[kind].upper() for kind, _, _ in others]) + 'K'
+        table = self.tables.get(name)
+        if table is None:
+            return None
+        offset, size, kingIndex = table
+
+        weak = 'b' if strong == 'w' else 'w'
+        placed = [kings[strong]] + [square for _, _, square in others] + [kings[weak]]
+        whiteToMove = cb.whiteToMove
+        if strong == 'b':
+            # swap the colours so the stronger side is white and its pawns run towards row 0
+            placed = [square ^ 56 for square in placed]
+            whiteToMove = not whiteToMove
+        king = placed[0]
+        if king % 8 > 3:
+            placed = [square ^ 7 for square in placed]
+            king ^= 7
+        if name != 'KPK':
+            if king // 8 < 4:
+                placed = [square ^ 56 for square in placed]
+                king ^= 56
+            if 7 - king // 8 > king % 8:
+                # reflect in the a1-h8 diagonal
+                placed = [(7 - square % 8) * 8 + 7 - square // 8 for square in placed]
+                king = placed[0]
+
+        index = kingIndex[king]
+        for square in placed[1:]:
+            index = index * 64 + square
+        value = self.data[offset + (0 if whiteToMove else size) + index]
+        if value == ILLEGAL_BYTE:
+            return None
+        if value == DRAW_BYTE:
+            return DRAW, 0
+        return (WIN if whiteToMove else LOSS), value - 1
+
+    """
+    The legal move that keeps the best result: the quickest mate when winning, the slowest when losing. None when
+    the position is not in the tables.
+    """
+    def bestMove(self, cb):
+        if self.probe(cb) is None:
+            return None
+        best = None
+        bestRank = None
+        for move in cb.getValidMoves():
+            cb.makeMove(move)
+            found = self.probe(cb)
+            cb.undoMove()
+            if found is None:
+                continue
+            result, plies = found
+            rank = (2, -plies) if result == LOSS else (0, plies) if result == WIN else (1, 0)
+            if bestRank is None or rank > bestRank:
+                best, bestRank = move, rank
+        return best
+
+    """
+    The moves of the main line from the position to mate, or as far as limit plies; past the perf_counter() deadline
+    the line is cut short after its first move
+    """
+    def line(self, cb, limit=200, deadline=None):
+        moves = []
+        while len(moves) < limit:
+            if moves and deadline is not None and time.perf_counter() >= deadline:
+                break
+            move = self.bestMove(cb)
+            if move is None:
+                break
+            moves.append(move)
+            cb.makeMove(move)
+        for _ in moves:
+            cb.undoMove()
+        return moves
+
+
+def randomPosition(name, rng, whiteStrong=True):
+    # a random placement of the ending's pieces, not necessarily legal
+    pieces = ['K'] + list(TABLES[name])
+    board = [['--'] * 8 for _ in range(8)]
+    strong, weak = ('w', 'b') if whiteStrong else ('b', 'w')
+    squares = rng.sample(range(64), len(pieces) + 1)
+    for kind, square in zip(pieces, squares):
+        board[square // 8][square % 8] = strong + kind
+    board[squares[-1] // 8][squares[-1] % 8] = weak + 'K'
+    return board
+
+
+"""
+Check the tables against ChessBoard's own move generator: for random positions of every ending, with either colour
+stronger, the stored result must follow from the results of the legal moves. Returns the number of mismatches.
+"""
+def verifyTablebase(tablebase, samples, seed=0, out=sys.stdout):
+    rng = random.Random(seed)
+    failures = 0
+    for name in tablebase.tables:
+        checked = 0
+        while checked < samples:
+            board = randomPosition(name, rng, rng.random() < 0.5)
+            if any([piece[1] == 'p' for piece in board[0] + board[7]]):
+                continue
+            cb = ChessBoard()
+            cb.setPosition(board, rng.random() < 0.5, CastlingRights(False, False, False, False), ())
+            stored = tablebase.probe(cb)
+            if stored is None:
+                continue  # the side not to move is in check
+            moves = cb.getValidMoves()
+            if not moves:
+                expected = (LOSS, 0) if cb.inCheck else (DRAW, 0)
+            else:
+                results = []
+                for move in moves:
+                    cb.makeMove(move)
+                    results.append(tablebase.probe(cb))
+                    cb.undoMove()
+                losses = [plies for result, plies in results if result == LOSS]
+                if losses:
+                    expected = (WIN, min(losses) + 1)
+                elif any([result == DRAW for result, _ in results]):
+                    expected = (DRAW, 0)
+                else:
+                    expected = (LOSS, max([plies for _, plies in results]) + 1)
+            if stored != expected:
+                failures += 1
+                print('%s %s: stored %s, moves give %s' % (name, cb.toFen(), stored, expected), file=out)
+            checked += 1
+        print('%s: %d positions checked' % (name, checked), file=out)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate, check and probe endgame tablebases')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help='solve endings and write them to a file')
+    generate.add_argument('file')
+    generate.add_argument('tables', nargs='*', metavar='TABLE', help='endings to solve: %s (default: all)' %
+                          ', '.join(TABLES))
+    verify = commands.add_parser('verify', help="check random positions against ChessBoard's moves")
+    verify.add_argument('file')
+    verify.add_argument('-n', '--samples', type=int, default=2000, help='positions per ending')
+    verify.add_argument('--seed', type=int, default=0)
+    probe = commands.add_parser('probe', help='look up a position and its best move')
+    probe.add_argument('file')
+    probe.add_argument('fen')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        unknown = [name for name in args.tables if name not in TABLES]
+        if unknown:
+            parser.error('unknown ending %s' % ', '.join(unknown))
+        start = time.perf_counter()
+
+        def progress(name, ply, found):
+            print('%s ply %d: %d positions' % (name, ply, found), file=sys.stderr, flush=True)
+
+        written = generateTablebase(args.file, args.tables or tuple(TABLES), progress)
+        print('%s written to %s (%d bytes) in %.1fs' % (', '.join(written), args.file, os.path.getsize(args.file),
+                                                        time.perf_counter() - start))
+        return 0
+
+    with Tablebase(args.file) as tablebase:
+        if args.command == 'verify':
+            failures = verifyTablebase(tablebase, args.samples, args.seed)
+            print('%d mismatches' % failures)
+            return 1 if failures else 0
+        cb = ChessBoard(fen=args.fen)
+        found = tablebase.probe(cb)
+        if found is None:
+            print('not in the tablebase')
+            return 1
+        result, plies = found
+        print('%s%s' % (result, ' in %d plies' % plies if result != DRAW else ''))
+        line = tablebase.line(cb, plies if result != DRAW else 10)
+        if line:
+            print('line: %s' % ' '.join([move.getUciNotation() for move in line]))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,284 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from ChessBook import OpeningBook
+from ChessEngine import ChessBoard, Move, ONGOING, CHECKMATE
+from ChessPgn import toSan, writeGame
+from ChessSearch import Searcher, MAX_PLY
+from ChessTablebase import Tablebase
+
+"""
+Headless self-play between two engine configurations on a process pool. Engines are given as specs such as
+'random', 'search:depth=3' or 'search:movetime=0.05,hash=8,backend=array,book=book.bin'. Games are played in
+colour-swapped pairs from the same (optionally randomized) opening, and every finished game is streamed to JSONL and
+PGN as it arrives.
+"""
+
+DEFAULT_MAX_PLIES = 400  # games still running here are adjudicated drawn
+
+
+def parseEngine(spec):
+    kind, _, options = spec.partition(':')
+    if kind not in ('random', 'search'):
+        raise ValueError('unknown engine %r, expected random or search:...' % spec)
+    config = {'type': kind}
+    for item in options.split(','):
+        if not item:
+            continue
+        name, _, value = item.partition('=')
+        if name in ('depth', 'nodes', 'hash'):
+            config[name] = int(value)
+        elif name == 'movetime':
+            config[name] = float(value)
+        elif name in ('backend', 'book', 'tablebase'):
+            config[name] = value
+        else:
+            raise ValueError('unknown engine option %r in %r' % (name, spec))
+    if kind == 'search' and not {'depth', 'nodes', 'movetime'} & set(config):
+        config['depth'] = 3
+    return config
+
+
+class RandomPlayer:
+    backend = 'array'
+
+    def __init__(self, config, seed):
+        self.random = random.Random(seed)
+
+    def chooseMove(self, cb):
+        return self.random.choice(cb.getValidMoves()), 0
+
+    def close(self):
+        pass
+
+
+class SearchPlayer:
+    def __init__(self, config, seed):
+        self.backend = config.get('backend', 'bitboard')
+        self.depth = config.get('depth', MAX_PLY)
+        self.timeLimit = config.get('movetime')
+        self.nodeLimit = config.get('nodes')
+        book = OpeningBook(config['book']) if 'book' in config else None
+        tablebase = Tablebase(config['tablebase']) if 'tablebase' in config else None
+        self.searcher = Searcher(hashMB=config.get('hash', 16), info=None, book=book, tablebase=tablebase)
+
+    def chooseMove(self, cb):
+        result = self.searcher.search(cb, self.depth, self.timeLimit, self.nodeLimit)
+        return result.bestMove, result.nodes
+
+    def close(self):
+        # the book and tablebase are mmaps; a worker plays many games and must not keep every game's open
+        if self.searcher.book is not None:
+            self.searcher.book.close()
+        if self.searcher.tablebase is not None:
+            self.searcher.tablebase.close()
+
+
+PLAYERS = {'random': RandomPlayer, 'search': SearchPlayer}
+
+
+"""
+Play a game of random moves from the starting position; the same seed always gives the same opening
+"""
+def randomOpening(plies, seed):
+    rng = random.Random(seed)
+    cb = ChessBoard()
+    for _ in range(plies):
+        moves = cb.getValidMoves()
+        if not moves:
+            break
+        cb.makeMove(rng.choice(moves))
+    return [move.encoded for move in cb.moveLog]
+
+
+def playGame(task):
+    index, configs, opening, maxPlies, seed = task
+    players = []
+    try:
+        for side, config in enumerate(configs):
+            players.append(PLAYERS[config['type']](config, seed * 2 + side))
+        return runGame(index, players, opening, maxPlies)
+    finally:
+        for player in players:
+            player.close()
+
+
+def runGame(index, players, opening, maxPlies):
+    # each backend in the game keeps its own board; the first one also referees
+    boards = {'array': ChessBoard()}
+    for player in players:
+        if player.backend not in boards:
+            boards[player.backend] = ChessBoard(player.backend)
+    referee = boards['array']
+
+    def play(encoded):
+        for board in boards.values():
+            board.makeMove(Move.fromEncoded(encoded, board.board))
+
+    sanMoves = []
+    for encoded in opening:
+        sanMoves.append(toSan(referee, Move.fromEncoded(encoded, referee.board)))
+        play(encoded)
+
+    nodes = [0, 0]
+    thinking = [0.0, 0.0]
+    latencies = [[], []]
+    status = referee.status()
+    while status == ONGOING and len(referee.moveLog) < maxPlies:
+        side = 0 if referee.whiteToMove else 1
+        player = players[side]
+        start = time.perf_counter()
+        move, searched = player.chooseMove(boards[player.backend])
+        elapsed = time.perf_counter() - start
+        nodes[side] += searched
+        thinking[side] += elapsed
+        latencies[side].append(elapsed)
+        sanMoves.append(toSan(referee, Move.fromEncoded(move.encoded, referee.board)))
+        play(move.encoded)
+        status = referee.status()
+
+    if status == CHECKMATE:
+        result = '0-1' if referee.whiteToMove else '1-0'
+    else:
+        result = '1/2-1/2'
+    return {
+        'game': index, 'result': result, 'termination': status if status != ONGOING else 'max plies',
+        'plies': len(referee.moveLog), 'opening': len(opening), 'san': sanMoves,
+        'uci': [move.getUciNotation() for move in referee.moveLog], 'fen': referee.toFen(),
+        'nodes': nodes, 'time': thinking, 'latencies': latencies,
+    }
+
+
+"""
+Tasks for count games between engines a and b, a playing white in even games. Each pair of games shares its opening.
+"""
+def makeTasks(count, engineA, engineB, openingPlies, maxPlies, seed):
+    for index in range(count):
+        opening = randomOpening(openingPlies, seed + index // 2) if openingPlies else []
+        configs = (engineA, engineB) if index % 2 == 0 else (engineB, engineA)
+        yield index, configs, opening, maxPlies, seed + index
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+"""
+Elo difference for an average score, with the 95% interval from the spread of the per-game scores
+"""
+def eloEstimate(scores):
+    count = len(scores)
+    if count == 0:
+        return 0.0, 0.0
+    mean = sum(scores) / count
+    deviation = math.sqrt(sum([(score - mean) ** 2 for score in scores]) / count)
+    margin = 1.96 * deviation / math.sqrt(count)
+
+    def elo(score):
+        score = min(max(score, 1e-6), 1 - 1e-6)
+        return -400 * math.log10(1 / score - 1)
+
+    return elo(mean), (elo(min(mean + margin, 1)) - elo(max(mean - margin, 0))) / 2
+
+
+class TournamentStats:
+    # win/draw/loss, speed and move latency of engine A against engine B
+    def __init__(self):
+        self.wins = self.draws = self.losses = 0
+        self.scores = []
+        self.nodes = [0, 0]
+        self.time = [0.0, 0.0]
+        self.latencies = [[], []]
+        self.gameNps = [[], []]
+
+    def add(self, record):
+        # record sides are white and black; turn them into A and B
+        aSide = 0 if record['game'] % 2 == 0 else 1
+        score = {'1-0': 1.0, '0-1': 0.0}.get(record['result'], 0.5)
+        if aSide == 1:
+            score = 1.0 - score
+        self.scores.append(score)
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        for engine, side in ((0, aSide), (1, 1 - aSide)):
+            self.nodes[engine] += record['nodes'][side]
+            self.time[engine] += record['time'][side]
+            self.latencies[engine].extend(record['latencies'][side])
+            if record['time'][side] > 0:
+                self.gameNps[engine].append(record['nodes'][side] / record['time'][side])
+
+    def report(self, names, elapsed):
+        games = len(self.scores)
+        elo, margin = eloEstimate(self.scores)
+        lines = ['%d games in %.1fs: %s vs %s' % (games, elapsed, names[0], names[1]),
+                 '  +%d =%d -%d  score %.1f%%  Elo %+.0f +/- %.0f' % (
+                     self.wins, self.draws, self.losses, 100 * sum(self.scores) / games if games else 0, elo, margin)]
+        for engine in (0, 1):
+            latencies = sorted(self.latencies[engine])
+            nps = sorted(self.gameNps[engine])
+            lines.append('  %-30s nodes/sec %8d (game median %8d)  move ms p50 %7.1f p90 %7.1f p99 %7.1f max %7.1f' % (
+                names[engine], self.nodes[engine] / self.time[engine] if self.time[engine] else 0,
+                percentile(nps, 0.5), 1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.9),
+                1000 * percentile(latencies, 0.99), 1000 * (latencies[-1] if latencies else 0)))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play engine configurations against each other on a process pool')
+    parser.add_argument('-a', '--engine-a', default='search:depth=2', help="first engine, e.g. 'search:depth=3'")
+    parser.add_argument('-b', '--engine-b', default='random', help="second engine, e.g. 'random'")
+    parser.add_argument('-n', '--games', type=int, default=10)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--opening-plies', type=int, default=4, help='random plies played before the engines start')
+    parser.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--jsonl', help='append a JSON line per finished game here')
+    parser.add_argument('--pgn', help='append every finished game here as PGN')
+    args = parser.parse_args(argv)
+
+    try:
+        engines = (parseEngine(args.engine_a), parseEngine(args.engine_b))
+    except ValueError as e:
+        parser.error(str(e))
+    names = (args.engine_a, args.engine_b)
+    jsonl = open(args.jsonl, 'a') if args.jsonl else None
+    pgn = open(args.pgn, 'a') if args.pgn else None
+    stats = TournamentStats()
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(args.workers) as pool:
+            tasks = makeTasks(args.games, engines[0], engines[1], args.opening_plies, args.max_plies, args.seed)
+            for record in pool.imap_unordered(playGame, tasks):
+                stats.add(record)
+                white, black = (names[0], names[1]) if record['game'] % 2 == 0 else (names[1], names[0])
+                if jsonl is not None:
+                    jsonl.write(json.dumps(dict(record, white=white, black=black)) + '\n')
+                    jsonl.flush()
+                if pgn is not None:
+                    writeGame(pgn, {'Event': 'Self-play', 'Round': record['game'] + 1, 'White': white,
+                                    'Black': black, 'Result': record['result'], 'Termination': record['termination'],
+                                    'PlyCount': record['plies']}, record['san'], record['result'])
+                    pgn.flush()
+                print('game %d: %s %s %s (%s, %d plies)' % (record['game'] + 1, white, record['result'], black,
+                                                           record['termination'], record['plies']), flush=True)
+    finally:
+        if jsonl is not None:
+            jsonl.close()
+        if pgn is not None:
+            pgn.close()
+    print(stats.report(names, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
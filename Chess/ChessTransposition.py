@@ -0,0 +1,73 @@
+from array import array
+
+"""
+Fixed-size transposition table keyed by ChessBoard.zobristKey. Entries live in parallel typed arrays indexed by the
+low bits of the key, so the table never grows and never allocates per entry. A slot is overwritten when it is empty,
+was written during an earlier search, or holds a result searched to no more depth than the new one.
+"""
+
+EXACT = 0
+LOWER = 1  # the stored value is a lower bound (the search failed high)
+UPPER = 2  # the stored value is an upper bound (the search failed low)
+
+ENTRY_BYTES = 8 + 8 + 1 + 1 + 2 + 1
+
+
+class TranspositionTable:
+    def __init__(self, sizeMB=16):
+        entries = 1
+        while entries * 2 * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            entries *= 2
+        self.size = entries
+        self.mask = entries - 1
+        self.age = 0
+        self.clear()
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.values = array('q', bytes(8 * self.size))
+        self.depths = array('b', [-1]) * self.size  # -1 marks an empty slot
+        self.flags = array('B', bytes(self.size))
+        self.moves = array('H', bytes(2 * self.size))  # Move.encoded of the best move, 0 when there is none
+        self.ages = array('B', bytes(self.size))
+        self.hits = 0
+        self.probes = 0
+
+    """
+    Start a new search: entries from earlier searches become replaceable regardless of depth
+    """
+    def newSearch(self):
+        self.age = (self.age + 1) & 0xFF
+
+    """
+    (depth, value, flag, move) stored for the key, or None
+    """
+    def probe(self, key):
+        self.probes += 1
+        index = key & self.mask
+        if self.keys[index] != key or self.depths[index] < 0:
+            return None
+        self.hits += 1
+        return self.depths[index], self.values[index], self.flags[index], self.moves[index]
+
+    def store(self, key, depth, value, flag=EXACT, move=0):
+        index = key & self.mask
+        if self.depths[index] >= 0 and self.ages[index] == self.age and depth < self.depths[index]:
+            return False
+        if self.keys[index] == key and not move:
+            move = self.moves[index]  # keep the best move of a shallower result for the same position
+        self.keys[index] = key
+        self.values[index] = value
+        self.depths[index] = depth
+        self.flags[index] = flag
+        self.moves[index] = move
+        self.ages[index] = self.age
+        return True
+
+    """
+    Permille of slots in use, sampled from the first thousand like UCI's hashfull
+    """
+    def hashfull(self):
+        sample = min(1000, self.size)
+        used = sum([1 for i in range(sample) if self.depths[i] >= 0 and self.ages[i] == self.age])
+        return used * 1000 // sample
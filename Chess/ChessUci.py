@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ChessBook import OpeningBook
+from ChessEngine import ChessBoard, STARTING_FEN
+from ChessPerft import divide, PerftAborted
+from ChessSearch import Searcher, MAX_PLY
+from ChessTablebase import Tablebase
+
+"""
+Headless UCI front end. Commands are read from stdin on an asyncio event loop while searches and perft runs go to a
+worker thread, so isready and stop are answered at once even in the middle of a search.
+"""
+
+ENGINE_NAME = 'ChessEngine'
+ENGINE_AUTHOR = 'andywhtang'
+
+MOVE_OVERHEAD = 0.05  # seconds kept back from every timed search for I/O and the GUI
+DEFAULT_MOVES_TO_GO = 30
+
+
+"""
+Lines of stream as they arrive. Pipes, sockets and terminals are watched by the event loop; anything it cannot
+watch, such as a regular file, is read on a thread instead.
+"""
+async def readLines(stream):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream)
+    except (ValueError, OSError, NotImplementedError):
+        while True:
+            line = await loop.run_in_executor(None, stream.readline)
+            if not line:
+                return
+            yield line
+    else:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield line.decode('utf-8', 'replace')
+
+
+class UciEngine:
+    def __init__(self, output=None, backend='bitboard', hashMB=16):
+        self.output = output or sys.stdout
+        self.outputLock = threading.Lock()
+        self.backend = backend
+        self.hashMB = hashMB
+        self.searcher = Searcher(hashMB=hashMB, info=self.sendInfo)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.board = ChessBoard(backend)
+        self.task = None  # the running search or perft
+        self.perftStop = threading.Event()  # set to abandon the running perft
+        self.stopped = asyncio.Event()  # set by stop; an infinite search holds its bestmove until then
+        self.taskFen = None  # the position the running task started from, since the task moves about on the board
+
+    def send(self, line):
+        # search info comes from the worker thread, everything else from the event loop
+        with self.outputLock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def sendInfo(self, info, stream=None):
+        result = info['result']
+        score = 'mate %d' % result.mateIn if result.mateIn is not None else 'cp %d' % result.score
+        self.send('info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s' % (
+            result.depth, score, result.nodes, result.nps, result.elapsed * 1000, info['hashfull'],
+            ' '.join([move.getUciNotation() for move in result.pv])))
+
+    async def run(self, stream=None):
+        async for line in readLines(stream or sys.stdin):
+            if not await self.handle(line):
+                break
+        await self.finishTask(stop=True)
+        self.executor.shutdown()
+
+    """
+    Act on one command line; False once the engine should quit
+    """
+    async def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send('id name %s' % ENGINE_NAME)
+            self.send('id author %s' % ENGINE_AUTHOR)
+            self.send('option name Hash type spin default %d min 1 max 4096' % self.hashMB)
+            self.send('option name Backend type combo default %s var array var bitboard' % self.backend)
+            self.send('option name BookFile type string default <empty>')
+            self.send('option name TablebaseFile type string default <empty>')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            await self.finishTask(stop=True)
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            await self.finishTask(stop=True)
+            self.searcher.table.clear()
+            self.board = ChessBoard(self.backend)
+        elif command == 'position':
+            await self.finishTask(stop=True)
+            self.setPosition(args)
+        elif command == 'go':
+            await self.finishTask(stop=True)
+            if args[:1] == ['perft']:
+                self.startPerft(args[1:])
+            else:
+                self.startSearch(args)
+        elif command == 'perft':
+            await self.finishTask(stop=True)
+            self.startPerft(args)
+        elif command == 'stop':
+            await self.finishTask(stop=True)
+        elif command == 'd':
+            self.send('info string fen %s' % (self.taskFen if self.task is not None else self.board.toFen()))
+        elif command == 'quit':
+            return False
+        else:
+            self.send('info string unknown command %s' % command)
+        return True
+
+    async def finishTask(self, stop=False):
+        if self.task is not None:
+            if stop:
+                self.searcher.stop()
+                self.perftStop.set()
+                self.stopped.set()
+            await self.task
+            self.task = None
+
+    def setOption(self, args):
+        text = ' '.join(args)
+        if not text.startswith('name ') or ' value ' not in text:
+            return
+        name, value = text[5:].split(' value ', 1)
+        name = name.strip().lower()
+        value = value.strip()
+        try:
+            if name == 'hash':
+                self.hashMB = max(1, int(value))
+                self.searcher = Searcher(hashMB=self.hashMB, info=self.sendInfo, book=self.searcher.book,
+                                         tablebase=self.searcher.tablebase)
+            elif name == 'bookfile':
+                if self.searcher.book is not None:
+                    self.searcher.book.close()
+                self.searcher.book = OpeningBook(value) if value not in ('', '<empty>') else None
+            elif name == 'tablebasefile':
+                if self.searcher.tablebase is not None:
+                    self.searcher.tablebase.close()
+                self.searcher.tablebase = Tablebase(value) if value not in ('', '<empty>') else None
+            elif name == 'backend':
+                self.board = ChessBoard(value, self.board.toFen())
+                self.backend = value
+            else:
+                self.send('info string unknown option %s' % name)
+        except (ValueError, OSError) as e:
+            self.send('info string bad value for %s: %s' % (name, e))
+
+    def setPosition(self, args):
+        if 'moves' in args:
+            split = args.index('moves')
+            setup, moves = args[:split], args[split + 1:]
+        else:
+            setup, moves = args, []
+        try:
+            if setup[:1] == ['fen']:
+                board = ChessBoard(self.backend, ' '.join(setup[1:]))
+            else:
+                board = ChessBoard(self.backend, STARTING_FEN)
+        except ValueError as e:  # loadFen checks every field, so this covers any malformed FEN
+            self.send('info string bad position: %s' % e)
+            return
+        for text in moves:
+            move = self.findMove(board, text)
+            if move is None:
+                self.send('info string illegal move %s' % text)
+                break
+            board.makeMove(move)
+        self.board = board
+
+    @staticmethod
+    def findMove(board, text):
+        for move in board.getValidMoves():
+            if move.getUciNotation() == text:
+                return move
+        return None
+
+    @staticmethod
+    def parseGo(args):
+        params = {}
+        i = 0
+        while i < len(args):
+            name = args[i]
+            if name in ('infinite', 'ponder'):
+                params[name] = True
+                i += 1
+            elif name == 'searchmoves':
+                break  # not supported; everything after it is a move list
+            else:
+                try:
+                    params[name] = int(args[i + 1])
+                except (IndexError, ValueError):
+                    pass
+                i += 2
+        return params
+
+    """
+    Seconds to spend on this move, or None to search until told to stop
+    """
+    def allocateTime(self, params):
+        if 'movetime' in params:
+            return max(0.001, params['movetime'] / 1000 - MOVE_OVERHEAD / 2)
+        left = params.get('wtime' if self.board.whiteToMove else 'btime')
+        if left is None:
+            return None
+        increment = params.get('winc' if self.board.whiteToMove else 'binc', 0)
+        movesToGo = params.get('movestogo') or DEFAULT_MOVES_TO_GO
+        budget = min(left / movesToGo + increment * 0.75, left / 2) / 1000
+        return max(0.001, budget - MOVE_OVERHEAD)
+
+    def startSearch(self, args):
+        params = self.parseGo(args)
+        if params.get('infinite'):
+            timeLimit = None
+        else:
+            timeLimit = self.allocateTime(params)
+        depth = params.get('depth', MAX_PLY)
+        nodeLimit = params.get('nodes')
+        # a bare "go" searches until stop like "go infinite"; either may only answer bestmove once stopped, even if
+        # the search ends early on a forced move or a mate
+        infinite = timeLimit is None and 'depth' not in params and nodeLimit is None
+        board = self.board
+        searcher = self.searcher
+        stopped = self.stopped = asyncio.Event()
+        self.taskFen = board.toFen()
+
+        def search():
+            return searcher.search(board, depth, timeLimit, nodeLimit)
+
+        async def runSearch():
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, search)
+            if infinite:
+                await stopped.wait()
+            self.send('bestmove %s' % (result.bestMove.getUciNotation() if result.bestMove is not None else '0000'))
+
+        # cleared here rather than on the search thread, so a stop that comes before the thread starts still counts
+        searcher.clearStop()
+        self.task = asyncio.ensure_future(runSearch())
+
+    def startPerft(self, args):
+        try:
+            depth = int(args[0]) if args else 1
+        except ValueError:
+            self.send('info string bad perft depth %s' % args[0])
+            return
+        board = self.board
+        stop = self.perftStop = threading.Event()
+        self.taskFen = board.toFen()
+
+        def perft():
+            start = time.perf_counter()
+            results = divide(board, depth, stop=stop)
+            return results, time.perf_counter() - start
+
+        async def runPerft():
+            try:
+                results, elapsed = await asyncio.get_running_loop().run_in_executor(self.executor, perft)
+            except PerftAborted:
+                self.send('info string perft stopped')
+                return
+            for move, nodes in sorted(results.items()):
+                self.send('%s: %d' % (move, nodes))
+            total = sum(results.values())
+            self.send('')
+            self.send('Nodes searched: %d' % total)
+            self.send('info string perft %d nodes in %.3fs (%d nodes/sec)' % (
+                total, elapsed, total / elapsed if elapsed else 0))
+
+        self.task = asyncio.ensure_future(runPerft())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='UCI engine on stdin and stdout')
+    parser.add_argument('-b', '--backend', choices=('array', 'bitboard'), default='bitboard')
+    parser.add_argument('--hash', type=int, default=16, metavar='MB', help='transposition table size')
+    args = parser.parse_args(argv)
+    asyncio.run(UciEngine(backend=args.backend, hashMB=args.hash).run())
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,93 @@
+import multiprocessing
+from ChessEngine import ChessBoard
+from ChessSearch import Searcher, SearchAborted, MAX_PLY
+
+"""
+Move generation and engine search in a separate process, for front ends that must keep drawing and reading input
+while the engine thinks. Requests go to the worker over one queue and answers come back over another, each tagged
+with the id of its request. Positions travel as the 38-byte ChessBoard snapshot plus the position counts that
+repetition draws are judged from, and moves come back as Move.encoded ints to be rebuilt on the caller's board.
+cancel() makes the worker drop everything it has been asked so far, stopping a search that is under way.
+"""
+
+MOVES = 'moves'  # answered with (encoded legal moves, ChessBoard.status())
+SEARCH = 'search'  # answered with (encoded best move or None, score, depth)
+
+
+def _serve(requests, responses, cancelled, backend, hashMB):
+    searcher = Searcher(hashMB=hashMB, info=None)
+    current = [0]
+    # abandon the search as soon as the front end has cancelled its request
+    checkLimits = searcher.checkLimits
+
+    def checkLimitsOrCancelled():
+        if cancelled.value >= current[0]:
+            raise SearchAborted()
+        checkLimits()
+
+    searcher.checkLimits = checkLimitsOrCancelled
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        requestId, kind, snapshot, positionCounts, params = request
+        if cancelled.value >= requestId:
+            continue
+        current[0] = requestId
+        cb = ChessBoard.fromSnapshot(snapshot, backend)
+        cb.positionCounts.update(positionCounts)
+        if kind == MOVES:
+            payload = ([move.encoded for move in cb.getValidMoves()], cb.status())
+        else:
+            result = searcher.search(cb, params.get('depth', MAX_PLY), params.get('movetime'), params.get('nodes'))
+            if cancelled.value >= requestId:
+                continue
+            payload = (result.bestMove.encoded if result.bestMove is not None else None, result.score, result.depth)
+        responses.put((requestId, kind, payload))
+    responses.put(None)
+
+
+class EngineWorker:
+    """
+    A worker process serving MOVES and SEARCH requests in the order they were made
+    """
+
+    def __init__(self, backend='bitboard', hashMB=16):
+        self.requests = multiprocessing.Queue()
+        self.responses = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Value('q', 0, lock=False)
+        self.lastId = 0
+        self.process = multiprocessing.Process(target=_serve, daemon=True,
+                                               args=(self.requests, self.responses, self.cancelled, backend, hashMB))
+        self.process.start()
+
+    """
+    Ask about the current position of cb; returns the request id its answer will carry. params for SEARCH are the
+    depth, movetime and nodes limits of Searcher.search.
+    """
+    def request(self, cb, kind, **params):
+        self.lastId += 1
+        self.requests.put((self.lastId, kind, cb.toSnapshot(), cb.positionCounts, params))
+        return self.lastId
+
+    def cancel(self):
+        self.cancelled.value = self.lastId
+
+    """
+    The next (request id, kind, payload), waiting at most timeout seconds (forever for None); None once closed
+    """
+    def get(self, timeout=None):
+        return self.responses.get(timeout=timeout)
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()